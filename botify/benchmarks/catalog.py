@@ -0,0 +1,109 @@
+"""
+Compare peak memory and time of loading the track catalog and
+grouping it by artist: a list of Track objects sorted by artist
+(the former Catalog) against the columnar TrackColumns.
+
+Run from the botify directory::
+
+    python -m benchmarks.catalog --tracks 1000000
+    python -m benchmarks.catalog --catalog ./data/tracks.json
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from botify.track import Track, TrackColumns
+
+
+def make_catalog(path, count, artists, recommendations):
+    with open(path, "w") as out:
+        for track in range(count):
+            data = {
+                "track": track,
+                "artist": f"Artist {random.randrange(artists)}",
+                "title": f"Track title number {track}",
+                "recommendations": random.sample(range(count), recommendations),
+            }
+            out.write(json.dumps(data) + "\n")
+
+
+def load_objects(path):
+    with open(path) as catalog_file:
+        tracks = []
+        for line in catalog_file:
+            data = json.loads(line)
+            tracks.append(
+                Track(
+                    data["track"],
+                    data["artist"],
+                    data["title"],
+                    data.get("recommendations", []),
+                )
+            )
+    sorted_tracks = sorted(tracks, key=lambda track: track.artist)
+    artists = sum(
+        1 for _ in itertools.groupby(sorted_tracks, key=lambda track: track.artist)
+    )
+    return tracks, artists
+
+
+def load_columns(path):
+    with open(path) as catalog_file:
+        tracks = TrackColumns.read(catalog_file)
+    artists = sum(1 for _ in tracks.by_artist())
+    return tracks, artists
+
+
+def measure(load, path):
+    tracemalloc.start()
+    start = time.perf_counter()
+    tracks, artists = load(path)
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "tracks": len(tracks),
+        "artists": artists,
+        "seconds": elapsed,
+        "retained_mb": retained / 2 ** 20,
+        "peak_mb": peak / 2 ** 20,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--catalog", default=None, type=str)
+    parser.add_argument("--tracks", default=200000, type=int)
+    parser.add_argument("--artists", default=20000, type=int)
+    parser.add_argument("--recommendations", default=10, type=int)
+    args = parser.parse_args()
+
+    path = args.catalog
+    if path is None:
+        random.seed(42)
+        path = os.path.join(tempfile.mkdtemp(), "tracks.json")
+        make_catalog(path, args.tracks, args.artists, args.recommendations)
+
+    print(
+        f"{'loader':<10}{'tracks':>10}{'artists':>10}"
+        f"{'seconds':>10}{'retained MB':>14}{'peak MB':>10}"
+    )
+    for name, load in [("objects", load_objects), ("columns", load_columns)]:
+        result = measure(load, path)
+        print(
+            f"{name:<10}{result['tracks']:>10}{result['artists']:>10}"
+            f"{result['seconds']:>10.2f}{result['retained_mb']:>14.1f}"
+            f"{result['peak_mb']:>10.1f}"
+        )
+
+    if args.catalog is None:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Compare redis value codecs on the recommendation files shipped
+in ./data and on synthetic tracks.
+
+Run from the botify directory::
+
+    python -m benchmarks.codec --recommendations ./data/recommendations_svd.json
+"""
+import argparse
+import json
+import random
+import time
+
+from botify.codec import make_codec
+from botify.track import Track
+
+
+def load_recommendations(path, limit):
+    with open(path) as rf:
+        return [json.loads(line)["tracks"] for _, line in zip(range(limit), rf)]
+
+
+def make_tracks(count, recommendations):
+    return [
+        Track(
+            track,
+            f"Artist {random.randint(0, 10000)}",
+            f"Track title number {track}",
+            random.sample(range(50000), recommendations),
+        )
+        for track in range(count)
+    ]
+
+
+def measure(codec, values, repeats):
+    encoded = [codec.to_bytes(value) for value in values]
+    start = time.perf_counter_ns()
+    for _ in range(repeats):
+        for bts in encoded:
+            codec.from_bytes(bts)
+    elapsed = time.perf_counter_ns() - start
+    return {
+        "bytes_per_key": sum(map(len, encoded)) / len(encoded),
+        "decode_ns": elapsed / (repeats * len(encoded)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--recommendations", default="./data/recommendations_svd.json", type=str
+    )
+    parser.add_argument("--keys", default=1000, type=int)
+    parser.add_argument("--repeats", default=20, type=int)
+    args = parser.parse_args()
+
+    random.seed(42)
+    datasets = {
+        "recommendations": load_recommendations(args.recommendations, args.keys),
+        "tracks": make_tracks(args.keys, 10),
+    }
+
+    print(f"{'dataset':<16}{'codec':<8}{'bytes/key':>12}{'decode ns':>12}")
+    for dataset, values in datasets.items():
+        for name in ["pickle", "binary", "varint"]:
+            result = measure(make_codec(name), values, args.repeats)
+            print(
+                f"{dataset:<16}{name:<8}"
+                f"{result['bytes_per_key']:>12.1f}{result['decode_ns']:>12.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
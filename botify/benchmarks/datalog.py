@@ -0,0 +1,112 @@
+"""
+Compare the size and the load time of the JSON lines and the Parquet
+data logs written by :class:`botify.data.DataLogger` for the same
+synthetic events. Needs pyarrow, pandas is used if installed.
+
+Run from the botify directory::
+
+    python -m benchmarks.datalog --events 1000000
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+
+import pyarrow.parquet as pq
+
+from botify.data import DataLogger, Datum
+from botify.experiment import Experiments
+
+
+def make_events(count, users, tracks):
+    timestamp = int(time.time() * 1000)
+    for ix in range(count):
+        location = "last" if random.random() < 0.1 else "next"
+        yield location, Datum(
+            timestamp + ix,
+            random.randrange(users),
+            random.randrange(tracks),
+            random.random(),
+            random.random() / 100,
+            random.randrange(tracks) if location == "next" else None,
+        )
+
+
+def write(directory, sink, events, count):
+    config = {
+        "DATA_LOG_QUEUE_SIZE": count,
+        "DATA_LOG_FILE": os.path.join(directory, "data.json"),
+        "DATA_LOG_FILE_MAX_BYTES": 10 ** 12,
+        "DATA_LOG_FILE_BACKUP_COPIES": 1,
+        "DATA_LOG_SINKS": [sink],
+        "DATA_LOG_PARQUET_DIR": os.path.join(directory, "parquet"),
+    }
+    logger = DataLogger(SimpleNamespace(config=config), Experiments())
+    start = time.perf_counter()
+    for location, datum in events:
+        logger.log(location, datum)
+    logger.close()
+    return time.perf_counter() - start
+
+
+def load_json(directory):
+    path = os.path.join(directory, "data.json")
+    try:
+        import pandas as pd
+
+        return len(pd.read_json(path, lines=True))
+    except ImportError:
+        with open(path) as f:
+            return len([json.loads(line) for line in f])
+
+
+def load_parquet(directory):
+    table = pq.read_table(os.path.join(directory, "parquet"))
+    try:
+        return len(table.to_pandas())
+    except ImportError:
+        return table.num_rows
+
+
+def size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", default=1000000, type=int)
+    parser.add_argument("--users", default=10000, type=int)
+    parser.add_argument("--tracks", default=50000, type=int)
+    args = parser.parse_args()
+    # as in the server, the data logger's records are INFO
+    logging.getLogger().setLevel("INFO")
+
+    print(f"{'format':<10}{'MB':>10}{'write s':>10}{'load s':>10}")
+    for sink, path, load in [
+        ("json", "data.json", load_json),
+        ("parquet", "parquet", load_parquet),
+    ]:
+        random.seed(42)
+        with tempfile.TemporaryDirectory() as directory:
+            elapsed = write(
+                directory,
+                sink,
+                make_events(args.events, args.users, args.tracks),
+                args.events,
+            )
+            start = time.perf_counter()
+            rows = load(directory)
+            loaded = time.perf_counter() - start
+            assert rows == args.events, rows
+            megabytes = size(os.path.join(directory, path)) / 2 ** 20
+            print(f"{sink:<10}{megabytes:>10.1f}{elapsed:>10.2f}{loaded:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+"""
+Open-loop load generator for the botify HTTP API: requests to
+``/next``, ``/last`` and ``/track`` are sent at a fixed target rate
+whether or not the earlier ones have been answered, so a slow server
+builds up a queue instead of slowing the client down. Latencies are
+measured from the time a request was scheduled to be sent, which
+corrects for coordinated omission; the time from the actual send is
+reported as ``service_ms``.
+
+Sessions are replayed from data logs of the service (run the
+simulator against botify to record some) or generated at random.
+Results are printed as JSON, per endpoint, to compare commits::
+
+    python -m benchmarks.loadgen --rps 200 --duration 60 --log log/data.json
+    python -m benchmarks.loadgen --rps 200 --serve inmemory --output base.json
+
+With ``--serve`` a single-process server is started for the run, on
+fakeredis (``inmemory``) or on the redis at ``--redis-host``, reading
+``./data`` and writing ``./log`` of the current directory.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+BOTIFY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENDPOINTS = ("next", "last", "track")
+PERCENTILES = {"p50": 50, "p95": 95, "p99": 99, "p99.9": 99.9}
+
+# user, track, time listened
+Event = Tuple[int, int, float]
+
+
+@dataclass
+class Request:
+    endpoint: str
+    method: str
+    path: str
+    body: dict = None
+
+    def encode(self, host: str) -> bytes:
+        body = json.dumps(self.body).encode() if self.body is not None else b""
+        head = (
+            f"{self.method} {self.path} HTTP/1.1\r\nHost: {host}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+        )
+        return head.encode() + body
+
+
+def sessions_from_log(paths: List[str]) -> List[List[Event]]:
+    """
+    Split data log events into sessions: the ``next`` events of a user
+    in timestamp order, up to their ``last`` event.
+    """
+    events = defaultdict(list)
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                event = json.loads(line)
+                events[event["user"]].append(event)
+
+    sessions = []
+    for user_events in events.values():
+        session = []
+        for event in sorted(user_events, key=lambda event: event["timestamp"]):
+            session.append((event["user"], event["track"], event["time"]))
+            if event["message"] == "last":
+                sessions.append(session)
+                session = []
+        if session:
+            sessions.append(session)
+    return sessions
+
+
+def random_sessions(
+    count: int, users: int, tracks: int, length: float, rng: random.Random
+) -> List[List[Event]]:
+    """
+    Sessions of random users and tracks, of geometrically
+    distributed length with the given mean.
+    """
+    sessions = []
+    for _ in range(count):
+        user = rng.randrange(users)
+        size = 1 + int(rng.expovariate(1 / max(length - 1, 1e-9)))
+        sessions.append(
+            [(user, rng.randrange(tracks), rng.random()) for _ in range(size)]
+        )
+    return sessions
+
+
+def requests(
+    sessions: List[List[Event]], active: int, track_share: float, rng: random.Random
+) -> Iterator[Request]:
+    """
+    Interleave ``active`` sessions at a time, cycling through
+    ``sessions``: every event is a ``/next`` call, the last one of
+    a session is sent to ``/last``. A ``track_share`` of the events
+    is followed by a ``/track`` lookup of the played track.
+    """
+    pending = itertools.cycle(sessions)
+    playing = [iter(next(pending)) for _ in range(active)]
+    current = [next(session) for session in playing]
+    while True:
+        ix = rng.randrange(active)
+        user, track, listened = current[ix]
+        if rng.random() < track_share:
+            yield Request("track", "GET", f"/track/{track}")
+
+        following = next(playing[ix], None)
+        body = {"track": track, "time": listened}
+        if following is None:
+            yield Request("last", "POST", f"/last/{user}", body)
+            playing[ix] = iter(next(pending))
+            following = next(playing[ix])
+        else:
+            yield Request("next", "POST", f"/next/{user}", body)
+        current[ix] = following
+
+
+class ConnectionPool:
+    """
+    Keep-alive connections to the server, opened on demand up to
+    ``size``. Requests wait for a free one when all are busy.
+    """
+
+    def __init__(self, host: str, port: int, size: int):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.opened = 0
+        self.idle = asyncio.Queue()
+
+    async def acquire(self):
+        if self.idle.empty() and self.opened < self.size:
+            self.opened += 1
+            try:
+                return await asyncio.open_connection(self.host, self.port)
+            except Exception:
+                self.opened -= 1
+                raise
+        return await self.idle.get()
+
+    def release(self, connection):
+        self.idle.put_nowait(connection)
+
+    def discard(self, connection):
+        self.opened -= 1
+        connection[1].close()
+
+
+async def read_status(reader) -> int:
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    await reader.readexactly(length)
+    return status
+
+
+async def send(pool: ConnectionPool, request: Request, timeout: float):
+    """
+    Returns the send time and the status of the response,
+    0 if the request failed.
+    """
+    try:
+        connection = await pool.acquire()
+    except OSError:
+        return time.perf_counter(), 0
+    sent = time.perf_counter()
+    reader, writer = connection
+    try:
+        writer.write(request.encode(pool.host))
+        await writer.drain()
+        status = await asyncio.wait_for(read_status(reader), timeout)
+    except Exception:
+        pool.discard(connection)
+        return sent, 0
+    pool.release(connection)
+    return sent, status
+
+
+async def run(args, workload: Iterator[Request]):
+    """
+    Send requests at ``args.rps`` per second, evenly spaced or, with
+    ``--poisson``, as a Poisson process, for ``args.duration`` seconds.
+    Returns (endpoint, scheduled, sent, done, status) of each request.
+    """
+    pool = ConnectionPool(args.host, args.port, args.connections)
+    rng = random.Random(args.seed)
+    results = []
+
+    async def call(request, scheduled):
+        sent, status = await send(pool, request, args.timeout)
+        results.append(
+            (request.endpoint, scheduled, sent, time.perf_counter(), status)
+        )
+
+    tasks = []
+    start = time.perf_counter()
+    scheduled = start
+    for request in workload:
+        scheduled += rng.expovariate(args.rps) if args.poisson else 1 / args.rps
+        if scheduled >= start + args.duration:
+            break
+        await asyncio.sleep(max(scheduled - time.perf_counter(), 0))
+        tasks.append(asyncio.ensure_future(call(request, scheduled)))
+    await asyncio.gather(*tasks)
+
+    while not pool.idle.empty():
+        pool.idle.get_nowait()[1].close()
+    return start, results
+
+
+def percentiles(latencies) -> dict:
+    if not len(latencies):
+        return {}
+    latencies = np.asarray(latencies) * 1000
+    stats = {
+        name: round(float(value), 3)
+        for name, value in zip(
+            PERCENTILES, np.percentile(latencies, list(PERCENTILES.values()))
+        )
+    }
+    stats["max"] = round(float(latencies.max()), 3)
+    return stats
+
+
+def report(args, start: float, results) -> dict:
+    measured = [
+        result for result in results if result[1] >= start + args.warmup
+    ]
+    endpoints = {}
+    for endpoint in ENDPOINTS:
+        calls = [result for result in measured if result[0] == endpoint]
+        if not calls:
+            continue
+        # a 404 of an unknown track is an answer, failed requests have status 0
+        ok = [result for result in calls if 0 < result[4] < 500]
+        endpoints[endpoint] = {
+            "requests": len(calls),
+            "errors": len(calls) - len(ok),
+            "error_rate": round((len(calls) - len(ok)) / len(calls), 6),
+            "latency_ms": percentiles([done - scheduled for _, scheduled, _, done, _ in ok]),
+            "service_ms": percentiles([done - sent for _, _, sent, done, _ in ok]),
+        }
+
+    window = args.duration - args.warmup
+    return {
+        "commit": commit(),
+        "target_rps": args.rps,
+        "achieved_rps": round(len(measured) / window, 1) if window > 0 else None,
+        "duration": args.duration,
+        "warmup": args.warmup,
+        "connections": args.connections,
+        "endpoints": endpoints,
+    }
+
+
+def commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BOTIFY_DIR,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextmanager
+def serve(args):
+    """
+    Run a single-process botify server for the duration of the load
+    test, with every redis connection redirected to fakeredis or to
+    ``--redis-host``.
+    """
+    with open(os.path.join(BOTIFY_DIR, "botify", "config.json")) as f:
+        config = json.load(f)
+    prefixes = [key[: -len("_HOST")] for key in config if key.endswith("_HOST")]
+    if args.serve == "inmemory":
+        overrides = {f"{prefix}_CLASS": "fakeredis.FakeStrictRedis" for prefix in prefixes}
+    else:
+        overrides = {f"{prefix}_HOST": args.redis_host for prefix in prefixes}
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as settings:
+        json.dump(overrides, settings)
+        settings.flush()
+        env = dict(
+            os.environ,
+            BOTIFY_CONFIG=settings.name,
+            PYTHONPATH=os.pathsep.join([BOTIFY_DIR, os.environ.get("PYTHONPATH", "")]),
+        )
+        server = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.join(BOTIFY_DIR, "botify", "server.py"),
+                "--workers",
+                "1",
+                "--port",
+                str(args.port),
+            ],
+            env=env,
+        )
+        try:
+            wait_until_alive(args.host, args.port, server, args.startup_timeout)
+            yield
+        finally:
+            server.terminate()
+            server.wait()
+
+
+def wait_until_alive(host: str, port: int, server: subprocess.Popen, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"Server exited with code {server.returncode}")
+        try:
+            urllib.request.urlopen(f"http://{host}:{port}/", timeout=1)
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError(f"Server did not start in {timeout} seconds")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load test of botify")
+    parser.add_argument("--host", default="127.0.0.1", type=str)
+    parser.add_argument("--port", default=5001, type=int)
+    parser.add_argument("--rps", default=100.0, type=float, help="Target request rate")
+    parser.add_argument("--duration", default=30.0, type=float)
+    parser.add_argument(
+        "--warmup", default=5.0, type=float, help="Seconds excluded from the report"
+    )
+    parser.add_argument("--poisson", action="store_true", help="Poisson arrivals")
+    parser.add_argument("--connections", default=256, type=int)
+    parser.add_argument("--timeout", default=10.0, type=float)
+    parser.add_argument(
+        "--log", nargs="*", default=[], help="Data logs to replay sessions from"
+    )
+    parser.add_argument("--users", default=10000, type=int)
+    parser.add_argument("--tracks", default=50000, type=int)
+    parser.add_argument("--session-length", default=10.0, type=float)
+    parser.add_argument("--active-sessions", default=1000, type=int)
+    parser.add_argument(
+        "--track-share", default=0.1, type=float, help="Share of /track lookups"
+    )
+    parser.add_argument("--seed", default=31337, type=int)
+    parser.add_argument("--serve", choices=["inmemory", "redis"], default=None)
+    parser.add_argument("--redis-host", default="localhost", type=str)
+    parser.add_argument("--startup-timeout", default=600.0, type=float)
+    parser.add_argument("--output", default=None, type=str)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sessions = (
+        sessions_from_log(args.log)
+        if args.log
+        else random_sessions(
+            args.active_sessions * 10, args.users, args.tracks, args.session_length, rng
+        )
+    )
+    workload = requests(sessions, args.active_sessions, args.track_share, rng)
+
+    if args.serve is not None:
+        with serve(args):
+            start, results = asyncio.run(run(args, workload))
+    else:
+        start, results = asyncio.run(run(args, workload))
+
+    result = json.dumps(report(args, start, results), indent=2)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(result + "\n")
+    print(result)
+
+
+if __name__ == "__main__":
+    main()
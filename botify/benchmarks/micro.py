@@ -0,0 +1,274 @@
+"""
+In-process microbenchmarks of every recommender and of the catalog
+codec, on a fakeredis seeded from the files in ``--data`` just like
+the server seeds redis. For each case it reports:
+
+* ``ns_per_op`` - the best mean time per call of ``--rounds`` rounds,
+* ``alloc_bytes_per_op`` - the mean peak memory allocated by a call,
+  traced in a separate pass,
+* ``retained_blocks_per_op`` - memory blocks still allocated after
+  the calls, nonzero when a call leaks or grows a cache,
+* ``bytes_per_key`` - the mean size of the redis values a call reads.
+
+Results are compared with the committed baseline, cases slower by
+more than ``--tolerance`` are reported as regressions. Run from the
+botify directory::
+
+    python -m benchmarks.micro
+    python -m benchmarks.micro --check
+    python -m benchmarks.micro --save
+
+Timings depend on the machine: refresh the baseline with ``--save``
+on the machine that runs ``--check``.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from botify.recommenders.contextual import Contextual
+from botify.recommenders.indexed import Indexed
+from botify.recommenders.random import Random
+from botify.recommenders.sequential import Sequential
+from botify.recommenders.sticky_artist import StickyArtist
+from botify.recommenders.toppop import TopPop
+from botify.store import RedisRecommendations, successors_key
+from botify.track import Catalog
+
+# Python < 3.9 has no reset_peak, clearing the traces resets the peak too
+reset_peak = getattr(tracemalloc, "reset_peak", tracemalloc.clear_traces)
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+CONFIG = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "botify", "config.json"
+)
+
+
+def make_redis(db: int):
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit("The benchmarks need fakeredis: pip install fakeredis")
+    return fakeredis.FakeStrictRedis(db=db)
+
+
+def seed(data: str, codec: str):
+    """
+    Load the catalog and upload tracks and SVD recommendations to
+    a fresh fakeredis. Returns the catalog, the tracks and the
+    recommendations connections.
+    """
+    with open(CONFIG) as f:
+        config = json.load(f)
+    config["CATALOG_CODEC"] = codec
+    config["RECOMMENDATIONS_DEBIAS_SVD_FILE_PATH"] = os.path.join(
+        data, "recommendations_svd.json"
+    )
+    app = SimpleNamespace(config=config, logger=logging.getLogger("benchmarks"))
+
+    catalog = Catalog(app).load(os.path.join(data, "tracks.json"))
+    tracks_redis, recommendations_redis = make_redis(0), make_redis(1)
+    for connection in [tracks_redis, recommendations_redis]:
+        connection.flushdb()
+    catalog.upload_tracks(tracks_redis)
+    catalog.upload_recommendations(
+        recommendations_redis, "RECOMMENDATIONS_DEBIAS_SVD_FILE_PATH"
+    )
+    return catalog, tracks_redis, recommendations_redis
+
+
+def value_sizes(connection, keys) -> float:
+    sizes = [len(value) for value in connection.mget(keys) if value is not None]
+    return sum(sizes) / len(sizes) if sizes else 0.0
+
+
+def hash_sizes(connection, keys) -> float:
+    """
+    Mean size of the fields and values of successor hashes.
+    """
+    sizes = [
+        sum(len(field) + len(value) for field, value in connection.hgetall(key).items())
+        for key in keys
+    ]
+    return sum(sizes) / len(sizes) if sizes else 0.0
+
+
+def cases(args, catalog, tracks_redis, recommendations_redis):
+    """
+    Returns the benchmarked calls: name -> (call of one argument
+    taken from the request list, bytes per key read).
+    """
+    rng = random.Random(args.seed)
+    track_ids = catalog.track_ids()
+    with open(os.path.join(args.data, "recommendations_svd.json")) as f:
+        users = [json.loads(line)["user"] for line in f]
+    sample = [rng.choice(users) for _ in range(1000)]
+
+    random_recommender = Random(track_ids)
+    top_tracks, counts = TopPop.load_from_json(os.path.join(args.data, "top_tracks.json"))
+    store = RedisRecommendations(recommendations_redis)
+    tracks_sample = [int(track) for track in rng.sample(list(track_ids), 1000)]
+    encoded = [catalog.to_bytes(catalog.tracks[ix]) for ix in range(1000)]
+
+    recommenders = {
+        "random": (random_recommender, None),
+        "toppop": (TopPop(top_tracks, random_recommender, counts), None),
+        "sequential": (
+            Sequential(store, catalog, random_recommender),
+            hash_sizes(recommendations_redis, [successors_key(u) for u in sample[:100]]),
+        ),
+        "indexed": (
+            Indexed(store, catalog, random_recommender),
+            value_sizes(recommendations_redis, sample),
+        ),
+        "contextual": (
+            Contextual(tracks_redis, catalog, random_recommender),
+            value_sizes(tracks_redis, tracks_sample),
+        ),
+        "sticky_artist": (StickyArtist(catalog), None),
+    }
+    result = {
+        name: (
+            lambda request, recommender=recommender: recommender.recommend_next(
+                *request
+            ),
+            size,
+        )
+        for name, (recommender, size) in recommenders.items()
+    }
+    result["catalog.to_bytes"] = (
+        lambda request: catalog.to_bytes(catalog.tracks[request[0] % len(catalog.tracks)]),
+        sum(map(len, encoded)) / len(encoded),
+    )
+    result["catalog.from_bytes"] = (
+        lambda request: catalog.from_bytes(encoded[request[0] % len(encoded)]),
+        sum(map(len, encoded)) / len(encoded),
+    )
+
+    requests = [
+        (user, track, rng.random()) for user, track in zip(sample, tracks_sample)
+    ]
+    return result, requests
+
+
+def measure(call, requests, rounds: int) -> dict:
+    for request in requests:  # warm up caches and samplers
+        call(request)
+
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter_ns()
+        for request in requests:
+            call(request)
+        elapsed = (time.perf_counter_ns() - start) / len(requests)
+        best = elapsed if best is None else min(best, elapsed)
+
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    allocated = 0
+    for request in requests:
+        reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        call(request)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    retained = sys.getallocatedblocks() - blocks
+
+    return {
+        "ns_per_op": round(best),
+        "alloc_bytes_per_op": round(allocated / len(requests)),
+        "retained_blocks_per_op": round(max(retained, 0) / len(requests), 3),
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Names of the cases slower than the baseline by more than ``tolerance``.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["ns_per_op"] / max(baseline[name]["ns_per_op"], 1)
+        result["vs_baseline"] = round(ratio, 3)
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommender and codec microbenchmarks")
+    parser.add_argument("--data", default="./data", type=str)
+    parser.add_argument("--codec", default="binary", type=str)
+    parser.add_argument("--rounds", default=10, type=int)
+    parser.add_argument("--seed", default=42, type=int)
+    parser.add_argument("--only", nargs="*", default=None, help="Cases to run")
+    parser.add_argument("--baseline", default=BASELINE, type=str)
+    parser.add_argument("--tolerance", default=0.5, type=float)
+    parser.add_argument(
+        "--check", action="store_true", help="Exit with 1 on regressions"
+    )
+    parser.add_argument(
+        "--save", action="store_true", help="Write the results as the new baseline"
+    )
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    catalog, tracks_redis, recommendations_redis = seed(args.data, args.codec)
+    calls, requests = cases(args, catalog, tracks_redis, recommendations_redis)
+
+    results = {}
+    for name, (call, bytes_per_key) in calls.items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = measure(call, requests, args.rounds)
+        results[name]["bytes_per_key"] = (
+            round(bytes_per_key, 1) if bytes_per_key is not None else None
+        )
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.tolerance)
+
+    print(f"{'case':<20}{'ns/op':>10}{'alloc B/op':>12}{'B/key':>10}{'vs base':>10}")
+    for name, result in results.items():
+        print(
+            f"{name:<20}{result['ns_per_op']:>10}{result['alloc_bytes_per_op']:>12}"
+            f"{result['bytes_per_key'] if result['bytes_per_key'] is not None else '-':>10}"
+            f"{result.get('vs_baseline', '-'):>10}"
+        )
+    for name in regressions:
+        print(f"Regression: {name} is {results[name]['vs_baseline']}x the baseline")
+
+    if args.save:
+        for result in results.values():
+            result.pop("vs_baseline", None)
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "codec": args.codec,
+                    "tracks": len(catalog.tracks),
+                    "results": {**baseline, **results},
+                },
+                f,
+                indent=2,
+            )
+            f.write("\n")
+
+    if args.check and regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Latency of nearest-track queries of the Contextual recommender on
+random embeddings, uncached (every query searches the index) and
+served from the result cache.
+
+Run from the botify directory::
+
+    python -m benchmarks.neighbours --tracks 50000
+    python -m benchmarks.neighbours --tracks 1000000 --index HNSW32
+"""
+import argparse
+import time
+
+import numpy as np
+
+from botify.neighbours import NeighbourIndex
+
+
+def percentiles(latencies):
+    p50, p99 = np.percentile(np.asarray(latencies) * 1e6, [50, 99])
+    return f"p50 {p50:>8.0f}us  p99 {p99:>8.0f}us"
+
+
+def measure(index, tracks):
+    latencies = []
+    for track in tracks:
+        start = time.perf_counter()
+        index.nearest(int(track), exclude=(int(track) + 1,))
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tracks", default=50000, type=int)
+    parser.add_argument("--dimension", default=32, type=int)
+    parser.add_argument("--neighbours", default=100, type=int)
+    parser.add_argument("--index", default="Flat", type=str)
+    parser.add_argument("--queries", default=1000, type=int)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    embeddings = rng.standard_normal((args.tracks, args.dimension), dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+
+    index = NeighbourIndex(embeddings, args.neighbours, args.index)
+    queries = rng.integers(0, args.tracks, args.queries)
+    print(f"{index.backend} {args.index}, {args.tracks} tracks")
+    print(f"uncached  {percentiles(measure(index, queries))}")
+    print(f"cached    {percentiles(measure(index, queries))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Closed-loop throughput of a running botify server: ``--connections``
+keep-alive clients send ``POST /next`` requests back to back for
+``--duration`` seconds. Run it against the gevent and the ASGI
+servers on the same redis to compare them side by side::
+
+    python botify/server.py --workers 1 --port 5001
+    uvicorn botify.asgi:app --port 5002
+    python -m benchmarks.serving --port 5001
+    python -m benchmarks.serving --port 5002
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import numpy as np
+
+
+async def client(host, port, deadline, users, tracks, latencies):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            body = json.dumps(
+                {"track": random.randrange(tracks), "time": random.random()}
+            ).encode()
+            request = (
+                f"POST /next/{random.randrange(users)} HTTP/1.1\r\n"
+                f"Host: {host}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n"
+            ).encode()
+            start = time.perf_counter()
+            writer.write(request + body)
+            await writer.drain()
+            await read_response(reader)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def read_response(reader):
+    status = await reader.readline()
+    if not status.startswith(b"HTTP/1.1 200"):
+        raise RuntimeError(f"Unexpected response {status!r}")
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    await reader.readexactly(length)
+
+
+async def run(args):
+    latencies = []
+    deadline = time.perf_counter() + args.duration
+    await asyncio.gather(
+        *[
+            client(args.host, args.port, deadline, args.users, args.tracks, latencies)
+            for _ in range(args.connections)
+        ]
+    )
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1", type=str)
+    parser.add_argument("--port", default=5001, type=int)
+    parser.add_argument("--connections", default=32, type=int)
+    parser.add_argument("--duration", default=10.0, type=float)
+    parser.add_argument("--users", default=10000, type=int)
+    parser.add_argument("--tracks", default=50000, type=int)
+    args = parser.parse_args()
+
+    latencies = np.asarray(asyncio.run(run(args))) * 1000
+    p50, p99 = np.percentile(latencies, [50, 99])
+    print(
+        f"{args.host}:{args.port} {len(latencies) / args.duration:.0f} req/s, "
+        f"p50 {p50:.2f}ms, p99 {p99:.2f}ms over {args.connections} connections"
+    )
+
+
+if __name__ == "__main__":
+    main()
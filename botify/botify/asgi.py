@@ -0,0 +1,209 @@
+"""
+asyncio serving mode: an ASGI app with the same ``/``, ``/track``,
+``/next``, ``/last`` and ``/metrics`` contract as the gevent server,
+reading redis through pooled ``redis.asyncio`` clients. Catalog
+loading, seeding and the recommenders are shared with
+:mod:`botify.server`.
+
+Run from the botify directory with any ASGI server, e.g.::
+
+    uvicorn botify.asgi:app --port 5001 --workers 4
+"""
+import json
+import re
+import time
+from dataclasses import asdict
+from datetime import datetime
+
+import redis.asyncio
+
+from botify import server
+from botify.data import Datum
+from botify.metrics import metrics
+
+# connection settings copied from the synchronous clients
+CONNECTION_KWARGS = ("host", "port", "db", "username", "password", "socket_timeout")
+
+for connection in server.connections.values():
+    kwargs = connection.connection.connection_pool.connection_kwargs
+    # requests wait for a free connection instead of failing
+    connection.aconnection = redis.asyncio.Redis(
+        connection_pool=redis.asyncio.BlockingConnectionPool(
+            max_connections=server.app.config["ASYNC_REDIS_POOL_SIZE"],
+            **{key: kwargs[key] for key in CONNECTION_KWARGS if key in kwargs},
+        )
+    )
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message):
+        self.status = status
+        self.message = message
+
+
+async def read_json(receive) -> dict:
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    try:
+        value = json.loads(body) if body else {}
+    except ValueError:
+        raise HttpError(400, "Failed to decode JSON object")
+    if not isinstance(value, dict):
+        raise HttpError(400, "The JSON body must be an object")
+    return value
+
+
+def parse_playback(body: dict):
+    """
+    Same checks as the ``track`` and ``time`` arguments of the gevent server.
+    """
+    errors = {}
+    values = {}
+    for name, cast in [("track", int), ("time", float)]:
+        if body.get(name) is None:
+            errors[name] = "Missing required parameter in the JSON body"
+            continue
+        try:
+            values[name] = cast(body[name])
+        except (TypeError, ValueError):
+            errors[name] = f"invalid literal for {cast.__name__}(): {body[name]}"
+    if errors:
+        raise HttpError(400, errors)
+    return values["track"], values["time"]
+
+
+async def hello(receive):
+    return {
+        "status": "alive",
+        "message": "welcome to botify, the best toy music recommender",
+    }
+
+
+async def track(receive, track: int):
+    data = await server.tracks_cache.aget(track)
+    if data is None:
+        raise HttpError(404, "Track not found")
+    return asdict(server.catalog.from_bytes(data))
+
+
+async def next_track(receive, user: int):
+    start = time.time()
+
+    with metrics.timer("botify_stage_seconds", stage="parse"):
+        prev_track, prev_track_time = parse_playback(await read_json(receive))
+
+    with metrics.timer("botify_stage_seconds", stage="assignment"):
+        treatment = server.registry.assign(user)
+
+    with metrics.timer("botify_stage_seconds", stage="session"):
+        await server.sessions.aplayed(user, prev_track)
+
+    with metrics.timer(
+        "botify_recommend_seconds",
+        recommender=server.registry.names[treatment],
+        treatment=treatment.name,
+    ):
+        recommendation = await server.registry.arms[treatment].arecommend_next(
+            user, prev_track, prev_track_time
+        )
+
+    with metrics.timer("botify_stage_seconds", stage="logging"):
+        server.data_logger.log(
+            "next",
+            Datum(
+                int(datetime.now().timestamp() * 1000),
+                user,
+                prev_track,
+                prev_track_time,
+                time.time() - start,
+                recommendation,
+            ),
+        )
+    metrics.histogram("botify_request_seconds", endpoint="next").observe(
+        time.time() - start
+    )
+    return {"user": user, "track": recommendation}
+
+
+async def last_track(receive, user: int):
+    start = time.time()
+    prev_track, prev_track_time = parse_playback(await read_json(receive))
+    await server.sessions.aend(user)
+    server.data_logger.log(
+        "last",
+        Datum(
+            int(datetime.now().timestamp() * 1000),
+            user,
+            prev_track,
+            prev_track_time,
+            time.time() - start,
+        ),
+    )
+    metrics.histogram("botify_request_seconds", endpoint="last").observe(
+        time.time() - start
+    )
+    return {"user": user}
+
+
+ROUTES = [
+    ("GET", re.compile(r"/"), hello),
+    ("GET", re.compile(r"/track/(\d+)"), track),
+    ("POST", re.compile(r"/next/(\d+)"), next_track),
+    ("POST", re.compile(r"/last/(\d+)"), last_track),
+]
+
+
+async def send_response(send, status: int, body: bytes, content_type: bytes):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", content_type),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            for connection in server.connections.values():
+                await connection.aconnection.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    if scope["path"] == "/metrics":
+        return await send_response(
+            send, 200, metrics.render().encode(), b"text/plain; version=0.0.4"
+        )
+
+    status, body = 404, {"message": "The requested URL was not found on the server."}
+    for method, pattern, handler in ROUTES:
+        match = pattern.fullmatch(scope["path"])
+        if match is None:
+            continue
+        if scope["method"] != method:
+            status, body = 405, {"message": "The method is not allowed."}
+            continue
+        try:
+            status, body = 200, await handler(receive, *map(int, match.groups()))
+        except HttpError as e:
+            status, body = e.status, {"message": e.message}
+        break
+
+    await send_response(send, status, json.dumps(body).encode(), b"application/json")
@@ -0,0 +1,232 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Hashable
+
+from botify.metrics import Counter, Metrics
+
+MISSING = object()
+
+
+class LruCache:
+    """
+    A size- and TTL-bounded LRU cache, safe to share between threads
+    (the cascade recommender runs its sources on a thread pool).
+    Concurrent misses of the same key are coalesced: the first caller
+    loads the value, callers on other threads (or other coroutines,
+    with :meth:`aget`) wait for it instead of hitting the backend again.
+
+    Hits and misses are counted in ``hits`` and ``misses``, e.g.
+    counters exported by :class:`botify.metrics.Metrics`.
+    """
+
+    def __init__(
+        self, size: int, ttl: float, hits: Counter = None, misses: Counter = None
+    ):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.loading = {}
+        self.aloading = {}
+        self.hits = hits if hits is not None else Counter()
+        self.misses = misses if misses is not None else Counter()
+        self.lock = threading.Lock()
+
+    def lookup(self, key: Hashable):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return MISSING
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return MISSING
+            self.entries.move_to_end(key)
+            return value
+
+    def put(self, key: Hashable, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def count(self, hits: int, misses: int):
+        if hits:
+            self.hits.inc(hits)
+        if misses:
+            self.misses.inc(misses)
+
+    def get(self, key: Hashable, load: Callable[[], object]):
+        value = self.lookup(key)
+        if value is not MISSING:
+            self.count(1, 0)
+            return value
+
+        self.count(0, 1)
+        thread = threading.get_ident()
+        with self.lock:
+            pending, loader = self.loading.get(key, (None, None))
+            if pending is None:
+                pending = Future()
+                self.loading[key] = (pending, thread)
+        if loader == thread:
+            # another greenlet of this thread is loading the key,
+            # blocking on its result would block that greenlet too
+            return load()
+        if loader is not None:
+            return pending.result()
+
+        try:
+            value = load()
+        except Exception as e:
+            pending.set_exception(e)
+            raise
+        else:
+            self.put(key, value)
+            pending.set_result(value)
+            return value
+        finally:
+            with self.lock:
+                del self.loading[key]
+
+    async def aget(self, key: Hashable, load: Callable[[], Awaitable]):
+        """
+        :meth:`get` for coroutines: concurrent misses of a key
+        await the same load.
+        """
+        value = self.lookup(key)
+        if value is not MISSING:
+            self.count(1, 0)
+            return value
+
+        self.count(0, 1)
+        pending = self.aloading.get(key)
+        if pending is None:
+            pending = self.aloading[key] = asyncio.ensure_future(
+                self.aload(key, load)
+            )
+        # a cancelled caller doesn't cancel the load the others wait for
+        return await asyncio.shield(pending)
+
+    async def aload(self, key: Hashable, load: Callable[[], Awaitable]):
+        try:
+            value = await load()
+            self.put(key, value)
+            return value
+        finally:
+            del self.aloading[key]
+
+    def invalidate(self, key: Hashable):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def invalidate_many(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def hit_ratio(self) -> float:
+        lookups = self.hits.value + self.misses.value
+        return self.hits.value / lookups if lookups else 0.0
+
+
+class CachedRedis:
+    """
+    Read-through cache in front of a redis connection. Values of GET
+    and MGET are cached decoded by ``decode``, so hot tracks, artists and
+    recommendation lists are neither fetched nor decoded again; HMGET
+    results are cached as returned. Misses, including keys not in
+    redis, are cached as well. Any other attribute is delegated to
+    the connection; writes through it do not invalidate the cache,
+    writers call :meth:`invalidate` instead (see ``Catalog.listeners``).
+    Writes by other processes are picked up once entries expire.
+    """
+
+    def __init__(
+        self,
+        connection,
+        db: str,
+        metrics: Metrics,
+        size: int,
+        ttl: float,
+        decode: Callable = None,
+    ):
+        self.connection = connection
+        self.db = db
+        self.cache = LruCache(
+            size,
+            ttl,
+            metrics.counter("botify_cache_hits_total", db=db),
+            metrics.counter("botify_cache_misses_total", db=db),
+        )
+        self.decode = decode or (lambda value: value)
+        metrics.gauge("botify_cache_hit_ratio", self.cache.hit_ratio, db=db)
+        metrics.gauge("botify_cache_entries", lambda: len(self.cache.entries), db=db)
+
+    def get(self, name):
+        return self.cache.get(name, lambda: self.fetch(name))
+
+    def fetch(self, name):
+        value = self.connection.get(name)
+        return None if value is None else self.decode(value)
+
+    def mget(self, keys, *args):
+        keys = list(keys) + list(args)
+        values = [self.cache.lookup(key) for key in keys]
+        missing = [key for key, value in zip(keys, values) if value is MISSING]
+        self.cache.count(len(keys) - len(missing), len(missing))
+        if missing:
+            fetched = iter(self.connection.mget(missing))
+            for ix, value in enumerate(values):
+                if value is MISSING:
+                    value = next(fetched)
+                    values[ix] = None if value is None else self.decode(value)
+                    self.cache.put(keys[ix], values[ix])
+        return values
+
+    def hmget(self, name, keys, *args):
+        if isinstance(keys, (list, tuple)):
+            fields = (*keys, *args)
+        else:
+            fields = (keys, *args)
+        return self.cache.get(
+            (name, fields), lambda: self.connection.hmget(name, keys, *args)
+        )
+
+    async def aget(self, name):
+        return await self.cache.aget(name, lambda: self.afetch(name))
+
+    async def afetch(self, name):
+        value = await self.connection.aget(name)
+        return None if value is None else self.decode(value)
+
+    async def ahmget(self, name, keys, *args):
+        if isinstance(keys, (list, tuple)):
+            fields = (*keys, *args)
+        else:
+            fields = (keys, *args)
+        return await self.cache.aget(
+            (name, fields), lambda: self.connection.ahmget(name, keys, *args)
+        )
+
+    def invalidate(self, keys=None):
+        """
+        Drop cached ``keys``, all of them if None.
+        """
+        if keys is None:
+            self.cache.clear()
+        else:
+            self.cache.invalidate_many(keys)
+
+    def clear(self):
+        self.cache.clear()
+
+    def __getattr__(self, item):
+        return getattr(self.connection, item)
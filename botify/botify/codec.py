@@ -0,0 +1,170 @@
+import pickle
+import struct
+import sys
+from array import array
+from typing import List
+
+from botify.track import Track
+
+PICKLE_MARKER = 0x80  # every pickle since protocol 2 starts with PROTO opcode
+
+INT32_IDS = b"I"
+VARINT_IDS = b"V"
+TRACK = b"T"
+
+# track id, artist length, title length, number of recommendations
+TRACK_HEADER = struct.Struct("<iHHI")
+
+
+class Codec:
+    """
+    Converts values stored in redis (tracks and lists of IDs)
+    to bytes and back.
+    """
+
+    name = None
+
+    def to_bytes(self, instance) -> bytes:
+        raise NotImplementedError()
+
+    def from_bytes(self, bts):
+        raise NotImplementedError()
+
+
+class PickleCodec(Codec):
+    name = "pickle"
+
+    def to_bytes(self, instance) -> bytes:
+        return pickle.dumps(instance)
+
+    def from_bytes(self, bts):
+        return pickle.loads(bts)
+
+
+class BinaryCodec(Codec):
+    """
+    Compact binary layout for track metadata and ID lists.
+    The first byte of every value tells its layout:
+
+    * ``T`` - a track: fixed little-endian header followed by
+      utf-8 artist and title and an int32 recommendation array;
+    * ``I`` - a packed little-endian int32 array;
+    * ``V`` - zigzag delta-varint encoded IDs (smaller, slower to decode).
+
+    Values written by :class:`PickleCodec` are still decoded, so
+    a redis DB filled by an older server keeps working.
+    """
+
+    name = "binary"
+
+    def __init__(self, varint: bool = False):
+        self.varint = varint
+
+    def to_bytes(self, instance) -> bytes:
+        if isinstance(instance, Track):
+            return self.track_to_bytes(instance)
+        if isinstance(instance, (list, tuple)) and all(
+            isinstance(item, int) for item in instance
+        ):
+            if self.varint:
+                return VARINT_IDS + encode_varint_deltas(instance)
+            return INT32_IDS + int32_to_bytes(instance)
+        return pickle.dumps(instance)
+
+    def from_bytes(self, bts):
+        marker = bts[0]
+        if marker == INT32_IDS[0]:
+            return int32_from_bytes(bts, 1)
+        if marker == TRACK[0]:
+            return self.track_from_bytes(bts)
+        if marker == VARINT_IDS[0]:
+            return decode_varint_deltas(bts, 1)
+        if marker == PICKLE_MARKER:
+            return pickle.loads(bts)
+        raise ValueError(f"Unknown value layout: {marker}")
+
+    def track_to_bytes(self, track: Track) -> bytes:
+        artist = track.artist.encode("utf-8")
+        title = track.title.encode("utf-8")
+        recommendations = list(track.recommendations or [])
+        return b"".join(
+            [
+                TRACK,
+                TRACK_HEADER.pack(
+                    track.track, len(artist), len(title), len(recommendations)
+                ),
+                artist,
+                title,
+                int32_to_bytes(recommendations),
+            ]
+        )
+
+    def track_from_bytes(self, bts) -> Track:
+        track, artist_size, title_size, _ = TRACK_HEADER.unpack_from(bts, 1)
+        offset = 1 + TRACK_HEADER.size
+        artist = bytes(bts[offset : offset + artist_size]).decode("utf-8")
+        offset += artist_size
+        title = bytes(bts[offset : offset + title_size]).decode("utf-8")
+        offset += title_size
+        return Track(track, artist, title, int32_from_bytes(bts, offset))
+
+
+def int32_to_bytes(ids) -> bytes:
+    packed = array("i", ids)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def int32_from_bytes(bts, offset: int = 0) -> List[int]:
+    view = memoryview(bts)[offset:]
+    if sys.byteorder == "little":
+        return view.cast("i").tolist()
+    unpacked = array("i")
+    unpacked.frombytes(view)
+    unpacked.byteswap()
+    return unpacked.tolist()
+
+
+def encode_varint_deltas(ids) -> bytes:
+    out = bytearray()
+    previous = 0
+    for item in ids:
+        delta = item - previous
+        previous = item
+        zigzag = (delta << 1) ^ (delta >> 63)
+        while zigzag >= 0x80:
+            out.append((zigzag & 0x7F) | 0x80)
+            zigzag >>= 7
+        out.append(zigzag)
+    return bytes(out)
+
+
+def decode_varint_deltas(bts, offset: int = 0) -> List[int]:
+    ids = []
+    previous = 0
+    value = 0
+    shift = 0
+    for byte in memoryview(bts)[offset:]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        previous += (value >> 1) ^ -(value & 1)
+        ids.append(previous)
+        value = 0
+        shift = 0
+    return ids
+
+
+CODECS = {
+    "pickle": PickleCodec,
+    "binary": BinaryCodec,
+    "varint": lambda: BinaryCodec(varint=True),
+}
+
+
+def make_codec(name: str) -> Codec:
+    if name not in CODECS:
+        raise ValueError(f"Unknown codec: {name}, expected one of {list(CODECS)}")
+    return CODECS[name]()
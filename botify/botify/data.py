@@ -1,10 +1,25 @@
+import atexit
 import logging
+import os
+import queue
+import threading
+import time
 from dataclasses import dataclass, asdict
+from datetime import datetime
 from logging.handlers import RotatingFileHandler
 
+import numpy as np
 from pythonjsonlogger import jsonlogger
 
-from botify.experiment import Experiments
+from botify.experiment import Experiments, Treatment
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -17,6 +32,156 @@ class Datum:
     recommendation: int = None
 
 
+class BatchRotatingFileHandler(RotatingFileHandler):
+    """
+    A rotating file handler that leaves flushing the stream
+    to :meth:`flush_batch`, so a batch of records is written
+    to disk with a single flush.
+    """
+
+    def flush(self):
+        pass
+
+    def flush_batch(self):
+        self.acquire()
+        try:
+            if self.stream and hasattr(self.stream, "flush"):
+                self.stream.flush()
+        finally:
+            self.release()
+
+
+class ParquetSink:
+    """
+    Writes events to Parquet files in ``directory``: columns of the
+    Datum fields, the location as a dictionary-encoded ``message``
+    and, for every experiment, a column named after it with the
+    user's treatment as an int8-coded dictionary of treatment names.
+
+    Events are buffered and written in row groups of ``row_group_size``.
+    A file is written under a hidden name, which readers of the
+    directory skip, and renamed to ``<name>-<start time>.parquet`` once
+    it reaches ``max_bytes`` or is ``rotate_seconds`` old. Buffered
+    events are lost if the process is killed.
+    """
+
+    TYPES = {
+        "timestamp": "int64",
+        "user": "int32",
+        "track": "int32",
+        "time": "float32",
+        "latency": "float32",
+        "recommendation": "int32",
+    }
+
+    def __init__(
+        self,
+        directory: str,
+        name: str,
+        experiments: Experiments,
+        max_bytes: int,
+        rotate_seconds: float,
+        row_group_size: int = 65536,
+        compression: str = "zstd",
+    ):
+        self.directory = directory
+        self.name = name
+        self.experiments = experiments
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.row_group_size = row_group_size
+        self.compression = compression
+
+        self.locations = []
+        self.data = []
+        self.writer = None
+        self.path = None
+        # files of this sink started in the same microsecond still differ
+        self.sequence = 0
+        # time of the first event of the current file
+        self.started = None
+
+        # a treatment is coded by its value
+        self.treatments = pa.array([treatment.name for treatment in Treatment])
+        self.schema = pa.schema(
+            [("message", pa.dictionary(pa.int8(), pa.string()))]
+            + [(name, pa.from_numpy_dtype(np.dtype(t))) for name, t in self.TYPES.items()]
+            + [
+                (experiment.name, pa.dictionary(pa.int8(), pa.string()))
+                for experiment in experiments.experiments
+            ]
+        )
+
+    def write(self, batch):
+        if batch and self.started is None:
+            self.started = time.time()
+        for location, datum in batch:
+            self.locations.append(location)
+            self.data.append(datum)
+        if len(self.data) >= self.row_group_size:
+            self.write_row_group()
+        if self.started is not None and (
+            time.time() - self.started >= self.rotate_seconds
+            or (self.writer is not None and os.path.getsize(self.path) >= self.max_bytes)
+        ):
+            self.rotate()
+
+    def write_row_group(self):
+        if not self.data:
+            return
+        if self.writer is None:
+            started = datetime.fromtimestamp(self.started).strftime("%Y%m%dT%H%M%S%f")
+            self.sequence += 1
+            self.path = os.path.join(
+                self.directory, f".{self.name}-{started}-{self.sequence}.parquet"
+            )
+            self.writer = pq.ParquetWriter(
+                self.path, self.schema, compression=self.compression
+            )
+
+        locations, self.locations = self.locations, []
+        data, self.data = self.data, []
+        messages = pa.array(locations).dictionary_encode()
+        columns = [messages.cast(self.schema.field("message").type)]
+        for name in self.TYPES:
+            columns.append(
+                pa.array(
+                    [getattr(datum, name) for datum in data],
+                    type=self.schema.field(name).type,
+                )
+            )
+        users = [datum.user for datum in data]
+        for treatments in self.experiments.assign_many(users).values():
+            columns.append(
+                pa.DictionaryArray.from_arrays(
+                    treatments.astype(np.int8), self.treatments
+                )
+            )
+        try:
+            self.writer.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+        except Exception:
+            # don't append to a broken file, leave it hidden and start a new one
+            self.writer = None
+            self.started = None
+            raise
+
+    def rotate(self):
+        """
+        Close the current file and make it visible under its final name.
+        """
+        self.write_row_group()
+        if self.writer is None:
+            return
+        # a failure below only loses this file, the next one starts afresh
+        writer, self.writer = self.writer, None
+        self.started = None
+        writer.close()
+        directory, hidden = os.path.split(self.path)
+        os.replace(self.path, os.path.join(directory, hidden[1:]))
+
+    close = rotate
+
+
 class DataLogger:
     """
     Write the provided Datum to the local log file
@@ -25,26 +190,174 @@ class DataLogger:
     Use an object of this class to write logs of
     user events. These logs are subsequently loaded
     to HDFS for analysis.
+
+    Events are put to a bounded queue and written by a background
+    thread in batches of up to ``DATA_LOG_FLUSH_SIZE`` events or every
+    ``DATA_LOG_FLUSH_INTERVAL`` seconds, so formatting, disk stalls
+    and rotation do not add to request latency. When the queue is
+    full the event is dropped and counted. A batch that fails to be
+    written (e.g. a full disk) is logged and counted as ``failed``,
+    and the writer goes on with the next one.
+
+    ``DATA_LOG_SINKS`` selects the formats: "json" lines and/or
+    "parquet" files in ``DATA_LOG_PARQUET_DIR`` (see :class:`ParquetSink`),
+    which are several times smaller and load much faster for analysis.
     """
 
-    def __init__(self, app):
+    def __init__(self, app, experiments: Experiments = None):
         self.logger = logging.getLogger("data")
+        self.log_file = app.config["DATA_LOG_FILE"]
+        self.max_bytes = app.config["DATA_LOG_FILE_MAX_BYTES"]
+        self.backup_count = app.config["DATA_LOG_FILE_BACKUP_COPIES"]
+        self.experiment_context = experiments or Experiments()
 
-        handler = RotatingFileHandler(
-            app.config["DATA_LOG_FILE"],
-            maxBytes=app.config["DATA_LOG_FILE_MAX_BYTES"],
-            backupCount=app.config["DATA_LOG_FILE_BACKUP_COPIES"],
+        self.queue_size = app.config.get("DATA_LOG_QUEUE_SIZE", 100000)
+        self.flush_size = app.config.get("DATA_LOG_FLUSH_SIZE", 1000)
+        self.flush_interval = app.config.get("DATA_LOG_FLUSH_INTERVAL", 1.0)
+
+        self.sinks = app.config.get("DATA_LOG_SINKS", ["json"])
+        self.parquet_dir = app.config.get("DATA_LOG_PARQUET_DIR", "./log/parquet")
+        self.parquet_rotate_seconds = app.config.get(
+            "DATA_LOG_PARQUET_ROTATE_SECONDS", 3600
+        )
+        self.parquet_row_group_size = app.config.get(
+            "DATA_LOG_PARQUET_ROW_GROUP_SIZE", 65536
         )
-        formatter = jsonlogger.JsonFormatter()
-        handler.setFormatter(formatter)
+        if "parquet" in self.sinks and pa is None:
+            raise ImportError("Parquet data logs need pyarrow: pip install pyarrow")
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.failed = 0
+
+        # set by a pre-forked server so that each worker writes its own file
+        self.worker = None
+        self.pid = None
+        self.queue = None
+
+    def start(self):
+        """
+        Open the log file and start the writer thread. Happens on the
+        first event of every process, so forked workers don't share
+        the parent's (non-existing) thread.
+        """
+        log_file = self.log_file
+        if self.worker is not None:
+            root, extension = os.path.splitext(log_file)
+            log_file = f"{root}-{self.worker}{extension}"
 
-        self.logger.addHandler(handler)
-        self.experiment_context = Experiments()
+        self.handler = None
+        if "json" in self.sinks:
+            self.handler = BatchRotatingFileHandler(
+                log_file, maxBytes=self.max_bytes, backupCount=self.backup_count
+            )
+            formatter = jsonlogger.JsonFormatter()
+            self.handler.setFormatter(formatter)
+            self.logger.handlers = [self.handler]
+
+        self.parquet = None
+        if "parquet" in self.sinks:
+            os.makedirs(self.parquet_dir, exist_ok=True)
+            self.parquet = ParquetSink(
+                self.parquet_dir,
+                os.path.splitext(os.path.basename(log_file))[0],
+                self.experiment_context,
+                self.max_bytes,
+                self.parquet_rotate_seconds,
+                self.parquet_row_group_size,
+            )
+
+        self.queue = queue.Queue(self.queue_size)
+        self.stopped = threading.Event()
+        self.writer = threading.Thread(
+            target=self.run, name="data-logger", daemon=True
+        )
+        self.writer.start()
+        self.pid = os.getpid()
+        atexit.register(self.close)
 
     def log(self, location, datum: Datum):
-        values = asdict(datum)
-        values["experiments"] = {
-            experiment.name: experiment.assign(datum.user).name
-            for experiment in self.experiment_context.experiments
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.queue.put_nowait((location, datum))
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def run(self):
+        while not (self.stopped.is_set() and self.queue.empty()):
+            self.write_safely(self.next_batch())
+
+    def write_safely(self, batch):
+        try:
+            if batch:
+                self.write(batch)
+            elif self.parquet is not None:
+                self.parquet.write(batch)  # rotates an idle file on time
+        except Exception:
+            logger.exception(f"Failed to write {len(batch)} data log events")
+            self.failed += len(batch)
+
+    def next_batch(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        while len(batch) < self.flush_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def write(self, batch):
+        if self.handler is not None:
+            for location, datum in batch:
+                values = asdict(datum)
+                values["experiments"] = {
+                    experiment.name: treatment.name
+                    for experiment, treatment in zip(
+                        self.experiment_context.experiments,
+                        self.experiment_context.assign(datum.user),
+                    )
+                }
+                self.logger.info(location, extra=values)
+            self.handler.flush_batch()
+        if self.parquet is not None:
+            self.parquet.write(batch)
+        self.flushed += len(batch)
+
+    def close(self):
+        """
+        Stop the writer after it has written every queued event.
+        """
+        if self.pid != os.getpid():
+            return
+        if self.writer.is_alive():
+            self.stopped.set()
+            self.writer.join()
+        # whatever a dead writer left or was queued while it stopped
+        while not self.queue.empty():
+            batch = []
+            while len(batch) < self.flush_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.write_safely(batch)
+        if self.handler is not None:
+            self.handler.flush_batch()
+        if self.parquet is not None:
+            self.parquet.close()
+
+    def stats(self):
+        return {
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "flushed": self.flushed,
+            "failed": self.failed,
+            "queued": self.queue.qsize() if self.queue else 0,
         }
-        self.logger.info(location, extra=values)
@@ -1,6 +1,9 @@
 from enum import Enum
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import mmh3
+import numpy as np
 
 
 class Treatment(Enum):
@@ -53,6 +56,14 @@ class Experiment:
         user_hash = mmh3.hash(str(user), self.hash, False)
         return Treatment(user_hash % self.split.value)
 
+    def assign_many(self, users: Sequence[int]) -> np.ndarray:
+        """
+        Vectorized :meth:`assign` for offline analysis: returns
+        the treatment values of all the users as an int array.
+        """
+        users_hash = murmur3_32(np.asarray(users), self.hash & 0xFFFFFFFF)
+        return (users_hash % np.uint32(self.split.value)).astype(np.int64)
+
     def __repr__(self):
         return f"{self.name}:{self.split}"
 
@@ -76,5 +87,114 @@ class Experiments:
     DIVERSITY = Experiment("DIVERSITY", Split.THREE_WAY)
     DEBIAS = Experiment("DEBIAS", Split.HALF_HALF)
 
-    def __init__(self):
-        self.experiments = [Experiments.DEBIAS]
+    def __init__(
+        self, experiments: Optional[List[Experiment]] = None, cache_size: int = 65536
+    ):
+        self.experiments = (
+            experiments if experiments is not None else [Experiments.DEBIAS]
+        )
+        self.positions = {
+            experiment.name: ix for ix, experiment in enumerate(self.experiments)
+        }
+        self.assign = lru_cache(maxsize=cache_size)(self._assign)
+
+    def _assign(self, user: int) -> Tuple[Treatment, ...]:
+        return tuple(experiment.assign(user) for experiment in self.experiments)
+
+    def treatment(self, experiment: Experiment, user: int) -> Treatment:
+        """
+        Returns the user's treatment in the experiment, from the cached
+        assignment if the experiment is active.
+        """
+        if experiment.name in self.positions:
+            return self.assign(user)[self.positions[experiment.name]]
+        return experiment.assign(user)
+
+    def assign_many(self, users: Sequence[int]) -> Dict[str, np.ndarray]:
+        return {
+            experiment.name: experiment.assign_many(users)
+            for experiment in self.experiments
+        }
+
+
+def decimal_digits(values: np.ndarray) -> np.ndarray:
+    digits = np.ones(len(values), dtype=np.int64)
+    values = values // np.uint64(10)
+    while values.any():
+        digits += values > 0
+        values = values // np.uint64(10)
+    return digits
+
+
+def decimal_bytes(values: np.ndarray, negative: np.ndarray, length: int) -> np.ndarray:
+    """
+    ASCII codes of ``str(value)`` for values whose representation
+    (including the minus sign) is ``length`` characters long.
+    """
+    block = np.empty((len(values), length), dtype=np.uint32)
+    for position in reversed(range(length)):
+        block[:, position] = values % np.uint64(10) + np.uint64(ord("0"))
+        values = values // np.uint64(10)
+    block[negative, 0] = ord("-")
+    return block
+
+
+C1 = np.uint32(0xCC9E2D51)
+C2 = np.uint32(0x1B873593)
+
+
+def rotl32(x: np.ndarray, r: int) -> np.ndarray:
+    return (x << np.uint32(r)) | (x >> np.uint32(32 - r))
+
+
+def fmix32(h: np.ndarray) -> np.ndarray:
+    h ^= h >> np.uint32(16)
+    h *= np.uint32(0x85EBCA6B)
+    h ^= h >> np.uint32(13)
+    h *= np.uint32(0xC2B2AE35)
+    h ^= h >> np.uint32(16)
+    return h
+
+
+def murmur3_32(users: np.ndarray, seed: int) -> np.ndarray:
+    """
+    MurmurHash3 x86_32 of the decimal representation of every user,
+    bit-identical to ``mmh3.hash(str(user), seed, False)``.
+    Users are grouped by the length of their representation,
+    and each group is hashed in a single pass over its 4-byte blocks.
+    """
+    users = users.astype(np.int64)
+    negative = users < 0
+    bits = users.view(np.uint64)
+    with np.errstate(over="ignore"):
+        # two's complement negation, also correct for the minimal int64
+        magnitude = np.where(negative, ~bits + np.uint64(1), bits)
+    lengths = negative.astype(np.int64) + decimal_digits(magnitude)
+
+    result = np.empty(len(users), dtype=np.uint32)
+    with np.errstate(over="ignore"):
+        for length in np.unique(lengths):
+            rows = lengths == length
+            block = decimal_bytes(magnitude[rows], negative[rows], length)
+            h = np.full(len(block), seed, dtype=np.uint32)
+
+            for offset in range(0, length - length % 4, 4):
+                k = (
+                    block[:, offset]
+                    | block[:, offset + 1] << np.uint32(8)
+                    | block[:, offset + 2] << np.uint32(16)
+                    | block[:, offset + 3] << np.uint32(24)
+                )
+                k = rotl32(k * C1, 15) * C2
+                h = rotl32(h ^ k, 13) * np.uint32(5) + np.uint32(0xE6546B64)
+
+            tail = length % 4
+            if tail:
+                k = np.zeros(len(block), dtype=np.uint32)
+                for shift in reversed(range(tail)):
+                    k = k << np.uint32(8) | block[:, length - tail + shift]
+                h ^= rotl32(k * C1, 15) * C2
+
+            h ^= np.uint32(length)
+            result[rows] = fmix32(h)
+    return result
@@ -0,0 +1,255 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+# seconds, from 50us to 2.5s
+LATENCY_BUCKETS = (
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def reset(self):
+        with self.lock:
+            self.value = 0
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        bucket = bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.sum += value
+            self.count += 1
+
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * (len(self.buckets) + 1)
+            self.sum = 0.0
+            self.count = 0
+
+
+class Metrics:
+    """
+    In-process counters and latency histograms, rendered in
+    Prometheus text format by the ``/metrics`` endpoint.
+
+    Every process keeps its own metrics: with a pre-forked server
+    a scrape is answered by one of the workers, which is reported
+    in the ``worker`` label.
+
+    An example usage::
+
+        with metrics.timer("botify_stage_seconds", stage="parse"):
+            args = parser.parse_args()
+        metrics.counter("botify_redis_hits_total", db="tracks").inc()
+
+    """
+
+    def __init__(self):
+        self.counters: Dict[Tuple, Counter] = {}
+        self.histograms: Dict[Tuple, Histogram] = {}
+        self.gauges = {}
+        self.labels = {}
+        # series are created and updated from the cascade's threads too
+        self.lock = threading.Lock()
+
+    def counter(self, name: str, **labels) -> Counter:
+        key = (name, tuple(sorted(labels.items())))
+        counter = self.counters.get(key)
+        if counter is None:
+            with self.lock:
+                counter = self.counters.setdefault(key, Counter())
+        return counter
+
+    def histogram(self, name: str, **labels) -> Histogram:
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def gauge(self, name: str, collect, **labels):
+        """
+        Register a gauge whose value is read by calling ``collect``
+        at render time.
+        """
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = collect
+
+    def reset(self):
+        """
+        Zero every counter and histogram, keeping the series, e.g. to
+        leave out the redis calls of loading and seeding at startup.
+        """
+        with self.lock:
+            series = [*self.counters.values(), *self.histograms.values()]
+        for metric in series:
+            metric.reset()
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        histogram = self.histogram(name, **labels)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    def render(self) -> str:
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = dict(self.histograms)
+        lines = []
+        for name, kind, series in [
+            *self.grouped(counters, "counter"),
+            *self.grouped(gauges, "gauge"),
+            *self.grouped(histograms, "histogram"),
+        ]:
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in series:
+                if kind == "histogram":
+                    lines.extend(self.render_histogram(name, labels, value))
+                elif kind == "gauge":
+                    lines.append(f"{name}{format_labels(labels)} {value()}")
+                else:
+                    lines.append(f"{name}{format_labels(labels)} {value.value}")
+        return "\n".join(lines) + "\n"
+
+    def grouped(self, metrics, kind):
+        names = {}
+        for (name, labels), value in metrics.items():
+            names.setdefault(name, []).append(
+                (self.labels_with_defaults(labels), value)
+            )
+        return [(name, kind, series) for name, series in sorted(names.items())]
+
+    def labels_with_defaults(self, labels):
+        return tuple(self.labels.items()) + labels
+
+    def render_histogram(self, name, labels, histogram: Histogram):
+        with histogram.lock:
+            counts, total = list(histogram.counts), histogram.sum
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, counts):
+            cumulative += count
+            bucket_labels = labels + (("le", repr(bound)),)
+            yield f"{name}_bucket{format_labels(bucket_labels)} {cumulative}"
+        cumulative += counts[-1]
+        bucket_labels = labels + (("le", "+Inf"),)
+        yield f"{name}_bucket{format_labels(bucket_labels)} {cumulative}"
+        yield f"{name}_sum{format_labels(labels)} {total}"
+        yield f"{name}_count{format_labels(labels)} {cumulative}"
+
+
+def format_labels(labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+class InstrumentedRedis:
+    """
+    Wraps a redis connection to time GET-like commands and count
+    hits and misses per DB. Any other attribute is delegated to
+    the connection.
+
+    The ``a``-prefixed coroutines do the same on ``aconnection``,
+    a ``redis.asyncio`` client to the same DB set by the ASGI app.
+    """
+
+    def __init__(self, connection, db: str, metrics: Metrics):
+        self.connection = connection
+        self.aconnection = None
+        self.db = db
+        self.metrics = metrics
+        self.hits = metrics.counter("botify_redis_hits_total", db=db)
+        self.misses = metrics.counter("botify_redis_misses_total", db=db)
+
+    def get(self, name):
+        with self.timer("get"):
+            value = self.connection.get(name)
+        self.count([value])
+        return value
+
+    def mget(self, keys, *args):
+        with self.timer("mget"):
+            values = self.connection.mget(keys, *args)
+        self.count(values)
+        return values
+
+    def hmget(self, name, keys, *args):
+        with self.timer("hmget"):
+            values = self.connection.hmget(name, keys, *args)
+        # a missing hash has none of the fields
+        found = any(value is not None for value in values)
+        self.count([found or None])
+        return values
+
+    async def aget(self, name):
+        with self.timer("get"):
+            value = await self.aconnection.get(name)
+        self.count([value])
+        return value
+
+    async def amget(self, keys, *args):
+        with self.timer("mget"):
+            values = await self.aconnection.mget(keys, *args)
+        self.count(values)
+        return values
+
+    async def ahmget(self, name, keys, *args):
+        with self.timer("hmget"):
+            values = await self.aconnection.hmget(name, keys, *args)
+        found = any(value is not None for value in values)
+        self.count([found or None])
+        return values
+
+    def timer(self, command: str):
+        return self.metrics.timer("botify_redis_seconds", db=self.db, command=command)
+
+    def count(self, values):
+        for value in values:
+            if value is None:
+                self.misses.inc()
+            else:
+                self.hits.inc()
+
+    def __getattr__(self, item):
+        return getattr(self.connection, item)
+
+
+metrics = Metrics()
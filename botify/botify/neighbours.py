@@ -0,0 +1,122 @@
+import logging
+from typing import Container, List, Optional
+
+import numpy as np
+
+from botify.cache import MISSING, LruCache
+from botify.metrics import metrics
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+
+class NeighbourIndex:
+    """
+    Nearest tracks by inner product of track embeddings, the same
+    similarity the simulator uses. Embeddings are a float32 ``.npy``
+    matrix with a row per track ID, memory-mapped so that workers
+    share one page-cached copy.
+
+    Searches go to a faiss index built with ``index_factory``
+    (e.g. "Flat" or "HNSW32" for large catalogs) when faiss is
+    installed, and to a vectorized numpy top-k otherwise. The
+    ``neighbours`` nearest tracks of every queried track are cached.
+    """
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        neighbours: int = 100,
+        index: str = "Flat",
+        cache_size: int = 65536,
+    ):
+        self.embeddings = embeddings
+        self.neighbours = min(neighbours, len(embeddings) - 1)
+        self.cache = LruCache(cache_size, float("inf"))
+        self.index = None
+        if faiss is not None:
+            self.index = faiss.index_factory(
+                embeddings.shape[1], index, faiss.METRIC_INNER_PRODUCT
+            )
+            self.index.add(np.ascontiguousarray(embeddings, dtype=np.float32))
+        self.backend = "faiss" if self.index is not None else "numpy"
+        logger.info(
+            f"Indexed {len(embeddings)} track embeddings with {self.backend}"
+        )
+
+    @staticmethod
+    def load(path: str, **kwargs) -> "NeighbourIndex":
+        embeddings = np.load(path, mmap_mode="r")
+        if embeddings.dtype != np.float32 or embeddings.ndim != 2:
+            raise ValueError(f"{path} must hold a 2d float32 array")
+        return NeighbourIndex(embeddings, **kwargs)
+
+    def __contains__(self, track: int) -> bool:
+        return 0 <= track < len(self.embeddings)
+
+    def nearest(self, track: int, exclude: Container[int] = ()) -> List[int]:
+        """
+        Returns the cached nearest tracks to ``track``, closest first,
+        without the track itself and the ``exclude``-d ones (any
+        container, e.g. a :class:`botify.session.Session`).
+        """
+        return self.nearest_many([track], [exclude])[0]
+
+    def nearest_many(
+        self, tracks: List[int], excludes: Optional[List[Container[int]]] = None
+    ) -> List[List[int]]:
+        """
+        Batched :meth:`nearest`: the tracks missing from the cache
+        are searched at once.
+        """
+        results = [self.cache.lookup(track) for track in tracks]
+        missing = sorted(
+            {
+                track
+                for track, result in zip(tracks, results)
+                if result is MISSING and track in self
+            }
+        )
+        self.cache.count(len(tracks) - len(missing), len(missing))
+        found = {}
+        if missing:
+            with metrics.timer("botify_neighbours_seconds", backend=self.backend):
+                searched = self.search(np.asarray(missing, dtype=np.int64))
+            for track, neighbours in zip(missing, searched):
+                self.cache.put(track, neighbours)
+                found[track] = neighbours
+        results = [
+            found.get(track, []) if result is MISSING else result
+            for track, result in zip(tracks, results)
+        ]
+
+        if excludes is None:
+            return results
+        return [
+            [track for track in result if track not in exclude]
+            if exclude
+            else result
+            for result, exclude in zip(results, excludes)
+        ]
+
+    def search(self, tracks: np.ndarray) -> List[List[int]]:
+        # ask for one more, as a track is (usually) its own nearest neighbour
+        k = self.neighbours + 1
+        queries = np.asarray(self.embeddings[tracks], dtype=np.float32)
+        if self.index is not None:
+            _, ids = self.index.search(queries, k)
+        else:
+            scores = queries @ self.embeddings.T
+            ids = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            order = np.argsort(
+                -np.take_along_axis(scores, ids, axis=1), axis=1, kind="stable"
+            )
+            ids = np.take_along_axis(ids, order, axis=1)
+        return [
+            [int(i) for i in row if i != track and i >= 0][: self.neighbours]
+            for track, row in zip(tracks, ids)
+        ]
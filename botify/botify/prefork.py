@@ -0,0 +1,111 @@
+import logging
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Callable, Optional
+
+import gevent
+import numpy as np
+from gevent.pywsgi import WSGIServer
+
+logger = logging.getLogger(__name__)
+
+
+def listener(port: int, reuse_port: bool) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("", port))
+    sock.listen(1024)
+    sock.setblocking(False)
+    return sock
+
+
+def serve_worker(app, sock: socket.socket):
+    """
+    Serve requests until SIGTERM/SIGINT, then let in-flight
+    requests finish and return.
+    """
+    server = WSGIServer(sock, app)
+    gevent.signal_handler(signal.SIGTERM, server.stop)
+    gevent.signal_handler(signal.SIGINT, server.stop)
+    server.serve_forever()
+
+
+class Supervisor:
+    """
+    Pre-fork server: the process importing the app loads the catalog
+    and seeds redis once, then forks ``workers`` gevent servers that
+    inherit the loaded state (copy-on-write) and start serving only
+    when it is ready. Each worker listens on its own SO_REUSEPORT
+    socket, so the kernel balances connections between them; where
+    SO_REUSEPORT is unavailable they share the parent's socket.
+
+    Workers that die are restarted. SIGTERM/SIGINT are forwarded to
+    the workers, and the supervisor exits once they have stopped.
+    """
+
+    def __init__(
+        self,
+        app,
+        port: int,
+        workers: int,
+        on_worker_start: Optional[Callable[[int], None]] = None,
+    ):
+        self.app = app
+        self.port = port
+        self.workers = workers or os.cpu_count()
+        self.on_worker_start = on_worker_start
+        self.reuse_port = hasattr(socket, "SO_REUSEPORT")
+        self.shared = None if self.reuse_port else listener(port, False)
+        self.children = {}
+        self.stopping = False
+
+    def spawn(self, worker: int):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = worker
+            return
+
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        gevent.reinit()
+        # or every worker would draw the same "random" recommendations
+        random.seed()
+        np.random.seed()
+        if self.on_worker_start is not None:
+            self.on_worker_start(worker)
+        sock = self.shared or listener(self.port, True)
+        serve_worker(self.app, sock)
+        sys.exit(0)
+
+    def stop(self, signum, frame):
+        self.stopping = True
+        for pid in self.children:
+            os.kill(pid, signal.SIGTERM)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for worker in range(self.workers):
+            self.spawn(worker)
+        logger.info(f"Started {self.workers} workers on port {self.port}")
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+
+            worker = self.children.pop(pid, None)
+            if worker is not None and not self.stopping:
+                logger.warning(f"Worker {worker} exited with {status}, restarting")
+                time.sleep(1)
+                self.spawn(worker)
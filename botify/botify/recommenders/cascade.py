@@ -0,0 +1,180 @@
+import asyncio
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+import gevent
+from gevent.threadpool import ThreadPool
+
+from botify.metrics import Counter
+from .recommender import Recommender
+
+
+class NoRecommendation(Recommender):
+    """
+    Fallback of the cascade sources: a source without a recommendation
+    answers None, so that the cascade moves on to the next one.
+    """
+
+    def recommend_next(self, user: int, prev_track: int, prev_track_time: float):
+        return None
+
+    def recommend_next_batch(self, users, prev_tracks, prev_track_times):
+        return [None] * len(users)
+
+
+@dataclass
+class Source:
+    name: str
+    recommender: Recommender
+    # seconds since the start of the request
+    budget: float
+    timeouts: Counter
+    errors: Counter
+    picks: Counter
+
+
+class Cascade(Recommender):
+    """
+    Query several recommenders concurrently and answer with the first
+    one, in the order of ``sources``, that recommends a track within
+    its latency budget. Lower-priority answers that have already
+    arrived are used when higher-priority sources time out, fail or
+    have nothing to recommend. Nothing is waited for past ``deadline``:
+    slow sources are dropped and ``fallback``, which should be cheap
+    (e.g. TopPop), answers instead.
+
+    Sources run on a gevent pool of native threads, since redis calls
+    don't yield to other greenlets, and are waited for without
+    blocking the hub. A running call can't be stopped, so every source
+    has at most ``workers`` calls in flight; a source that is still
+    busy with as many late calls is skipped, counted as a timeout.
+    The async variant runs the sources as tasks of the event loop.
+    """
+
+    def __init__(
+        self,
+        sources: List[Source],
+        fallback: Recommender,
+        deadline: float,
+        workers: int = 4,
+    ):
+        self.sources = sources
+        self.fallback = fallback
+        self.deadline = deadline
+        self.workers = workers
+        self.slots = [threading.BoundedSemaphore(workers) for _ in sources]
+        # created in the serving process, after the server forks
+        self.pool = None
+        self.pid = None
+
+    def timeout(self, source: Source, start: float) -> float:
+        return max(min(source.budget, self.deadline) - (time.monotonic() - start), 0)
+
+    def submit(self, method: str, *args) -> list:
+        """
+        Start ``method`` of every source that has a free slot. Returns
+        their gevent results, None for the skipped sources.
+        """
+        if self.pid != os.getpid():
+            self.pool = ThreadPool(self.workers * len(self.sources))
+            self.pid = os.getpid()
+
+        results = []
+        for source, slots in zip(self.sources, self.slots):
+            if not slots.acquire(blocking=False):
+                results.append(None)
+                continue
+            results.append(
+                self.pool.spawn(run, slots, getattr(source.recommender, method), args)
+            )
+        return results
+
+    def collect(self, source: Source, result, start: float):
+        """
+        The answer of a source, or None if it timed out or failed.
+        """
+        if result is not None:
+            gevent.wait([result], timeout=self.timeout(source, start))
+        if result is None or not result.ready():
+            source.timeouts.inc()
+            return None
+        failed, value = result.value
+        if failed:
+            source.errors.inc()
+            return None
+        return value
+
+    def recommend_next(self, user: int, prev_track: int, prev_track_time: float) -> int:
+        start = time.monotonic()
+        results = self.submit("recommend_next", user, prev_track, prev_track_time)
+        for source, result in zip(self.sources, results):
+            recommendation = self.collect(source, result, start)
+            if recommendation is not None:
+                source.picks.inc()
+                return recommendation
+        return self.fallback.recommend_next(user, prev_track, prev_track_time)
+
+    async def arecommend_next(
+        self, user: int, prev_track: int, prev_track_time: float
+    ) -> int:
+        start = time.monotonic()
+        tasks = [
+            asyncio.ensure_future(
+                source.recommender.arecommend_next(user, prev_track, prev_track_time)
+            )
+            for source in self.sources
+        ]
+        try:
+            for source, task in zip(self.sources, tasks):
+                await asyncio.wait([task], timeout=self.timeout(source, start))
+                if not task.done():
+                    source.timeouts.inc()
+                    continue
+                if task.exception() is not None:
+                    source.errors.inc()
+                    continue
+                if task.result() is not None:
+                    source.picks.inc()
+                    return task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+        return await self.fallback.arecommend_next(user, prev_track, prev_track_time)
+
+    def recommend_next_batch(
+        self, users: List[int], prev_tracks: List[int], prev_track_times: List[float]
+    ) -> List[int]:
+        start = time.monotonic()
+        results = self.submit(
+            "recommend_next_batch", users, prev_tracks, prev_track_times
+        )
+        recommendations: List[Optional[int]] = [None] * len(users)
+        for source, result in zip(self.sources, results):
+            batch = self.collect(source, result, start)
+            if batch is None:
+                continue
+            for ix, recommendation in enumerate(batch):
+                if recommendations[ix] is None and recommendation is not None:
+                    recommendations[ix] = recommendation
+                    source.picks.inc()
+            if all(item is not None for item in recommendations):
+                break
+        return self.fill_missing(
+            recommendations, self.fallback, users, prev_tracks, prev_track_times
+        )
+
+
+def run(slots: threading.BoundedSemaphore, call, args):
+    """
+    Returns whether the call failed and its result, so that a failing
+    source is counted rather than reported by the pool.
+    """
+    try:
+        return False, call(*args)
+    except Exception as e:
+        return True, e
+    finally:
+        slots.release()
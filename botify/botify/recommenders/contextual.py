@@ -1,5 +1,7 @@
 from .recommender import Recommender
+import asyncio
 import random
+from typing import List
 
 """
 Recommend tracks closest to the previous one. Fall back to the random recommender if no recommendations found for the track.
@@ -7,23 +9,88 @@ Recommend tracks closest to the previous one. Fall back to the random recommende
 
 
 class Contextual(Recommender):
-    def __init__(self, tracks_redis, catalog, fallback):
+    """
+    Neighbours of the previous track are found online in the embedding
+    index when one is given, otherwise they are the ones precomputed
+    in the track's ``recommendations``. With a session store, tracks
+    already played in the session are not recommended.
+    """
+
+    def __init__(
+        self, tracks_redis, catalog, fallback, neighbours=None, sessions=None
+    ):
         self.tracks_redis = tracks_redis
         self.fallback = fallback
         self.catalog = catalog
+        self.neighbours = neighbours
+        self.sessions = sessions
 
     def recommend_next(self, user: int, prev_track: int, prev_track_time: float) -> int:
+        session = self.sessions.get(user) if self.sessions is not None else ()
+        if self.neighbours is not None:
+            recommendations = self.neighbours.nearest(prev_track, session)
+            if not recommendations:
+                return self.fallback.recommend_next(user, prev_track, prev_track_time)
+            return random.choice(recommendations)
+
         # 1. Get previous track from redis DB, fall back to Random if there is no one
         previous_track = self.tracks_redis.get(prev_track)
         if previous_track is None:
             return self.fallback.recommend_next(user, prev_track, prev_track_time)
 
         # 2. Get recommendations for previous track, fall back to Random if there is no recommendations
-        recommendations = self.catalog.from_bytes(previous_track)
+        recommendations = [
+            track
+            for track in self.catalog.from_bytes(previous_track).recommendations
+            if track not in session
+        ]
         if not recommendations:
             return self.fallback.recommend_next(user, prev_track, prev_track_time)
 
         # 3. Get random track from the recommendation list
-        shuffled = list(recommendations)
-        random.shuffle(shuffled)
-        return shuffled[0]
+        return random.choice(recommendations)
+
+    async def arecommend_next(
+        self, user: int, prev_track: int, prev_track_time: float
+    ) -> int:
+        if self.neighbours is not None:
+            session = await self.asession(self.sessions, user)
+            recommendations = self.neighbours.nearest(prev_track, session)
+        else:
+            previous_track, session = await asyncio.gather(
+                self.tracks_redis.aget(prev_track),
+                self.asession(self.sessions, user),
+            )
+            recommendations = [
+                track
+                for track in (
+                    self.catalog.from_bytes(previous_track).recommendations
+                    if previous_track is not None
+                    else []
+                )
+                if track not in session
+            ]
+
+        if not recommendations:
+            return await self.fallback.arecommend_next(
+                user, prev_track, prev_track_time
+            )
+        return random.choice(recommendations)
+
+    def recommend_next_batch(
+        self, users: List[int], prev_tracks: List[int], prev_track_times: List[float]
+    ) -> List[int]:
+        if self.neighbours is None:
+            return super().recommend_next_batch(users, prev_tracks, prev_track_times)
+
+        if self.sessions is not None:
+            sessions = self.sessions.get_many(users)
+        else:
+            sessions = [()] * len(users)
+        recommendations = [
+            random.choice(nearest) if nearest else None
+            for nearest in self.neighbours.nearest_many(prev_tracks, sessions)
+        ]
+        return self.fill_missing(
+            recommendations, self.fallback, users, prev_tracks, prev_track_times
+        )
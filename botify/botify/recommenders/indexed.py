@@ -1,20 +1,70 @@
+import asyncio
 import random
+from typing import List
 
 from .recommender import Recommender
 
 
 class Indexed(Recommender):
-    def __init__(self, recommendations_redis, catalog, fallback):
+    """
+    Recommend a random track of the user's precomputed list. With a
+    session store, tracks already played in the session are skipped
+    unless all of them have been played.
+    """
+
+    def __init__(self, recommendations_redis, catalog, fallback, sessions=None):
         self.recommendations_redis = recommendations_redis
         self.fallback = fallback
         self.catalog = catalog
+        self.sessions = sessions
 
     def recommend_next(self, user: int, prev_track: int, prev_track_time: float) -> int:
         recommendations = self.recommendations_redis.get(user)
 
         if recommendations is not None:
-            shuffled = list(self.catalog.from_bytes(recommendations))
-            random.shuffle(shuffled)
-            return shuffled[0]
+            session = self.sessions.get(user) if self.sessions is not None else ()
+            return self.pick(self.catalog.from_bytes(recommendations), session)
         else:
             return self.fallback.recommend_next(user, prev_track, prev_track_time)
+
+    async def arecommend_next(
+        self, user: int, prev_track: int, prev_track_time: float
+    ) -> int:
+        recommendations, session = await asyncio.gather(
+            self.recommendations_redis.aget(user),
+            self.asession(self.sessions, user),
+        )
+
+        if recommendations is not None:
+            return self.pick(self.catalog.from_bytes(recommendations), session)
+        else:
+            return await self.fallback.arecommend_next(
+                user, prev_track, prev_track_time
+            )
+
+    def recommend_next_batch(
+        self, users: List[int], prev_tracks: List[int], prev_track_times: List[float]
+    ) -> List[int]:
+        if self.sessions is not None:
+            sessions = self.sessions.get_many(users)
+        else:
+            sessions = [()] * len(users)
+        recommendations = [
+            self.pick(self.catalog.from_bytes(data), session)
+            if data is not None
+            else None
+            for data, session in zip(
+                self.recommendations_redis.get_many(users), sessions
+            )
+        ]
+        return self.fill_missing(
+            recommendations, self.fallback, users, prev_tracks, prev_track_times
+        )
+
+    @staticmethod
+    def pick(recommendations, session) -> int:
+        if session:
+            fresh = [track for track in recommendations if track not in session]
+            if fresh:
+                return int(random.choice(fresh))
+        return int(random.choice(recommendations))
@@ -1,9 +1,19 @@
+from typing import Optional, Sequence
+
+from botify.sampling import BatchSampler
 from .recommender import Recommender
 
 
 class Random(Recommender):
-    def __init__(self, track_redis):
-        self.track_redis = track_redis
+    """
+    Recommend a random track of the catalog, optionally weighted.
+    Samples in-process, without any redis round trip.
+    """
+
+    def __init__(
+        self, track_ids: Sequence[int], weights: Optional[Sequence[float]] = None
+    ):
+        self.sampler = BatchSampler(track_ids, weights)
 
     def recommend_next(self, user: int, prev_track: int, prev_track_time: float) -> int:
-        return int(self.track_redis.randomkey())
+        return self.sampler.sample()
@@ -1,3 +1,61 @@
+from typing import List, Optional
+
+
 class Recommender:
     def recommend_next(self, user: int, prev_track: int, prev_track_time: float) -> int:
         raise NotImplementedError()
+
+    async def arecommend_next(
+        self, user: int, prev_track: int, prev_track_time: float
+    ) -> int:
+        """
+        Async variant of :meth:`recommend_next` used by the ASGI app.
+        Recommenders that don't wait for I/O are served inline,
+        the others override it to run their lookups concurrently.
+        """
+        return self.recommend_next(user, prev_track, prev_track_time)
+
+    def recommend_next_batch(
+        self, users: List[int], prev_tracks: List[int], prev_track_times: List[float]
+    ) -> List[int]:
+        """
+        Recommend next tracks for several users at once. Recommenders
+        backed by a remote store override it to fetch all the data
+        they need in a single round trip.
+        """
+        return [
+            self.recommend_next(user, prev_track, prev_track_time)
+            for user, prev_track, prev_track_time in zip(
+                users, prev_tracks, prev_track_times
+            )
+        ]
+
+    @staticmethod
+    async def asession(sessions, user: int):
+        """
+        The user's session, or an empty one without a session store.
+        """
+        return await sessions.aget(user) if sessions is not None else ()
+
+    @staticmethod
+    def fill_missing(
+        recommendations: List[Optional[int]],
+        fallback: "Recommender",
+        users: List[int],
+        prev_tracks: List[int],
+        prev_track_times: List[float],
+    ) -> List[int]:
+        """
+        Replace missing (None) recommendations with the ones
+        of the fallback, asked in a single batch.
+        """
+        missing = [ix for ix, item in enumerate(recommendations) if item is None]
+        if missing:
+            fallbacks = fallback.recommend_next_batch(
+                [users[ix] for ix in missing],
+                [prev_tracks[ix] for ix in missing],
+                [prev_track_times[ix] for ix in missing],
+            )
+            for ix, recommendation in zip(missing, fallbacks):
+                recommendations[ix] = recommendation
+        return recommendations
@@ -1,26 +1,87 @@
+import asyncio
 from typing import List
 
 from .recommender import Recommender
 
+# successors tried when the next track was already played in the session
+MAX_SKIPS = 3
+
 
 class Sequential(Recommender):
-    def __init__(self, recommendations_redis, catalog, fallback):
+    """
+    Recommend the track following the previous one in the user's list
+    of precomputed recommendations, wrapping around at the end. Tracks
+    that are not in the list are treated as its first item.
+    The store resolves the successor in a single lookup.
+
+    With a session store, successors already played in the session
+    are skipped, up to ``MAX_SKIPS`` of them.
+    """
+
+    def __init__(self, recommendations_redis, catalog, fallback, sessions=None):
         self.recommendations_redis = recommendations_redis
         self.fallback = fallback
         self.catalog = catalog
+        self.sessions = sessions
 
     def recommend_next(self, user: int, prev_track: int, prev_track_time: float) -> int:
-        recommendations = self.recommendations_redis.get(user)
+        recommendation = self.recommendations_redis.successor(user, prev_track)
 
-        if recommendations is not None:
-            recommendations = list(self.catalog.from_bytes(recommendations))
-            next_rec_index = self.get_track_index(prev_track, recommendations)
-            return recommendations[(next_rec_index + 1) % len(recommendations)]
+        if recommendation is not None:
+            if self.sessions is not None:
+                session = self.sessions.get(user)
+                for _ in range(MAX_SKIPS):
+                    if recommendation not in session:
+                        break
+                    recommendation = self.recommendations_redis.successor(
+                        user, recommendation
+                    )
+            return recommendation
         else:
             return self.fallback.recommend_next(user, prev_track, prev_track_time)
 
-    def get_track_index(self, track: int, recommendations: List[int]) -> int:
-        for ix, recommendation in enumerate(recommendations):
-            if recommendation == track:
-                return ix
-        return 0
+    async def arecommend_next(
+        self, user: int, prev_track: int, prev_track_time: float
+    ) -> int:
+        recommendation, session = await asyncio.gather(
+            self.recommendations_redis.asuccessor(user, prev_track),
+            self.asession(self.sessions, user),
+        )
+
+        if recommendation is None:
+            return await self.fallback.arecommend_next(
+                user, prev_track, prev_track_time
+            )
+        for _ in range(MAX_SKIPS):
+            if recommendation not in session:
+                break
+            recommendation = await self.recommendations_redis.asuccessor(
+                user, recommendation
+            )
+        return recommendation
+
+    def recommend_next_batch(
+        self, users: List[int], prev_tracks: List[int], prev_track_times: List[float]
+    ) -> List[int]:
+        recommendations = self.recommendations_redis.successors(users, prev_tracks)
+        if self.sessions is not None:
+            sessions = self.sessions.get_many(users)
+            for _ in range(MAX_SKIPS):
+                played = [
+                    ix
+                    for ix, (recommendation, session) in enumerate(
+                        zip(recommendations, sessions)
+                    )
+                    if recommendation is not None and recommendation in session
+                ]
+                if not played:
+                    break
+                successors = self.recommendations_redis.successors(
+                    [users[ix] for ix in played],
+                    [recommendations[ix] for ix in played],
+                )
+                for ix, recommendation in zip(played, successors):
+                    recommendations[ix] = recommendation
+        return self.fill_missing(
+            recommendations, self.fallback, users, prev_tracks, prev_track_times
+        )
@@ -1,29 +1,29 @@
-import random
+from typing import List
 
-from .random import Random
 from .recommender import Recommender
 
 
 class StickyArtist(Recommender):
-    def __init__(self, tracks_redis, artists_redis, catalog):
-        self.fallback = Random(tracks_redis)
-        self.artists_redis = artists_redis
-        self.catalog = catalog
-        self.tracks_redis = tracks_redis
+    """
+    Recommend a random track by the artist of the previous one.
+    Both the artist and their tracks are looked up in the catalog's
+    in-memory :class:`botify.track.ArtistIndex`, without calling redis.
+    """
+
+    def __init__(self, catalog):
+        self.index = catalog.artist_index()
 
     def recommend_next(self, user: int, prev_track: int, prev_track_time: float) -> int:
-        track_data = self.tracks_redis.get(prev_track)
-        if track_data is not None:
-            track = self.catalog.from_bytes(track_data)
-        else:
+        recommendation = self.index.sample(prev_track)
+        if recommendation is None:
             raise ValueError(f"Track not found: {prev_track}")
+        return recommendation
 
-        artist_data = self.artists_redis.get(track.artist)
-
-        if artist_data is not None:
-            artist_tracks = self.catalog.from_bytes(artist_data)
-        else:
-            raise ValueError(f"Artist not found: {track.artist}")
-
-        index = random.randint(0, len(artist_tracks) - 1)
-        return artist_tracks[index]
+    def recommend_next_batch(
+        self, users: List[int], prev_tracks: List[int], prev_track_times: List[float]
+    ) -> List[int]:
+        recommendations = self.index.sample_many(prev_tracks)
+        for prev_track, recommendation in zip(prev_tracks, recommendations):
+            if recommendation is None:
+                raise ValueError(f"Track not found: {prev_track}")
+        return recommendations
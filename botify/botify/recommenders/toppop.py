@@ -1,24 +1,60 @@
 import json
 
-import numpy as np
-
-from typing import List
+from typing import List, Optional, Tuple
 
+from botify.sampling import BatchSampler
 from .recommender import Recommender
 
 
 class TopPop(Recommender):
+    """
+    Recommend one of the most popular tracks, uniformly or, given
+    their play counts, proportionally to them. Draws come from
+    pre-drawn batches of a :class:`botify.sampling.BatchSampler`.
+    """
+
     @staticmethod
-    def load_from_json(path: str) -> List[int]:
+    def load_from_json(path: str) -> Tuple[List[int], Optional[List[float]]]:
+        """
+        Returns top tracks and their counts, if the file has them.
+        A file holds either a list of track IDs, a list of
+        ``[track, count]`` pairs or ``{"track", "count"}`` objects,
+        or an object mapping track IDs to counts.
+        """
         with open(path, "r") as f:
-            return json.load(f)
-
-    def __init__(self, top_tracks: List[int], fallback: Recommender):
+            top = json.load(f)
+
+        if isinstance(top, dict):
+            return [int(track) for track in top], [float(c) for c in top.values()]
+        if top and isinstance(top[0], dict):
+            return (
+                [int(item["track"]) for item in top],
+                [float(item["count"]) for item in top],
+            )
+        if top and isinstance(top[0], list):
+            return [int(track) for track, _ in top], [float(c) for _, c in top]
+        return [int(track) for track in top], None
+
+    def __init__(
+        self,
+        top_tracks: List[int],
+        fallback: Recommender,
+        counts: Optional[List[float]] = None,
+    ):
         self.top_tracks = top_tracks
         self.fallback = fallback
+        self.sampler = BatchSampler(top_tracks, counts) if top_tracks else None
 
     def recommend_next(self, user: int, prev_track: int, prev_track_time: float) -> int:
-        if self.top_tracks:
-            return int(np.random.choice(self.top_tracks))
+        if self.sampler is not None:
+            return self.sampler.sample()
 
         return self.fallback.recommend_next(user, prev_track, prev_track_time)
+
+    def recommend_next_batch(
+        self, users: List[int], prev_tracks: List[int], prev_track_times: List[float]
+    ) -> List[int]:
+        if self.sampler is not None:
+            return self.sampler.sample_many(len(users))
+
+        return self.fallback.recommend_next_batch(users, prev_tracks, prev_track_times)
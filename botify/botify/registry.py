@@ -0,0 +1,240 @@
+from typing import Callable, Dict
+
+from botify.experiment import Experiment, Experiments, Treatment
+from botify.metrics import Counter, metrics
+from botify.neighbours import NeighbourIndex
+from botify.recommenders.cascade import Cascade, NoRecommendation, Source
+from botify.recommenders.contextual import Contextual
+from botify.recommenders.indexed import Indexed
+from botify.recommenders.random import Random
+from botify.recommenders.recommender import Recommender
+from botify.recommenders.sequential import Sequential
+from botify.recommenders.sticky_artist import StickyArtist
+from botify.recommenders.toppop import TopPop
+
+
+class RecommenderContext:
+    """
+    Shared resources the recommenders are built from.
+
+    ``recommendations`` maps a recommendations source name
+    (e.g. ``RECOMMENDATIONS_DEBIAS_SVD``) to the store serving it.
+    Each store is requested once and reused by every arm, and so is
+    the neighbour index of every embeddings file. ``sessions``, if set,
+    is the :class:`botify.session.SessionStore` recommenders use to
+    avoid repeating tracks.
+    """
+
+    def __init__(
+        self, catalog, tracks_redis, artists_redis, recommendations, sessions=None
+    ):
+        self.catalog = catalog
+        self.sessions = sessions
+        self.tracks_redis = tracks_redis
+        self.artists_redis = artists_redis
+        self.random = Random(catalog.track_ids())
+        self._recommendations = recommendations
+        self._stores = {}
+
+    def recommendations(self, name: str):
+        if name not in self._stores:
+            self._stores[name] = self._recommendations(name)
+        return self._stores[name]
+
+    def neighbours(self, embeddings_path: str, **options) -> NeighbourIndex:
+        key = (embeddings_path, tuple(sorted(options.items())))
+        if key not in self._stores:
+            self._stores[key] = NeighbourIndex.load(embeddings_path, **options)
+        return self._stores[key]
+
+
+def build_random(spec, context: RecommenderContext, fallback):
+    return context.random
+
+
+def build_toppop(spec, context: RecommenderContext, fallback):
+    top_tracks, counts = TopPop.load_from_json(spec["top_tracks"])
+    return TopPop(top_tracks, fallback, counts if spec.get("weighted", True) else None)
+
+
+def build_sequential(spec, context: RecommenderContext, fallback):
+    store = context.recommendations(spec["recommendations"])
+    return Sequential(store, context.catalog, fallback, context.sessions)
+
+
+def build_indexed(spec, context: RecommenderContext, fallback):
+    store = context.recommendations(spec["recommendations"])
+    return Indexed(store, context.catalog, fallback, context.sessions)
+
+
+def build_contextual(spec, context: RecommenderContext, fallback):
+    neighbours = None
+    if "embeddings" in spec:
+        neighbours = context.neighbours(
+            spec["embeddings"],
+            neighbours=spec.get("neighbours", 100),
+            index=spec.get("index", "Flat"),
+            cache_size=spec.get("cache_size", 65536),
+        )
+    return Contextual(
+        context.tracks_redis, context.catalog, fallback, neighbours, context.sessions
+    )
+
+
+def build_sticky_artist(spec, context: RecommenderContext, fallback):
+    return StickyArtist(context.catalog)
+
+
+def build_cascade(spec, context: RecommenderContext, fallback):
+    sources = []
+    for source in spec["sources"]:
+        name = source.get("name", source["type"])
+        sources.append(
+            Source(
+                name,
+                build_recommender(source, context, NoRecommendation()),
+                source.get("budget", spec["deadline"]),
+                metrics.counter("botify_cascade_timeouts_total", source=name),
+                metrics.counter("botify_cascade_errors_total", source=name),
+                metrics.counter("botify_cascade_picks_total", source=name),
+            )
+        )
+    return Cascade(sources, fallback, spec["deadline"], spec.get("workers", 4))
+
+
+class CountedFallback(Recommender):
+    """
+    Counts how often a recommender falls back.
+    """
+
+    def __init__(self, fallback: Recommender, counter: Counter):
+        self.fallback = fallback
+        self.counter = counter
+
+    def recommend_next(self, user: int, prev_track: int, prev_track_time: float) -> int:
+        self.counter.inc()
+        return self.fallback.recommend_next(user, prev_track, prev_track_time)
+
+    async def arecommend_next(
+        self, user: int, prev_track: int, prev_track_time: float
+    ) -> int:
+        self.counter.inc()
+        return await self.fallback.arecommend_next(user, prev_track, prev_track_time)
+
+    def recommend_next_batch(self, users, prev_tracks, prev_track_times):
+        self.counter.inc(len(users))
+        return self.fallback.recommend_next_batch(users, prev_tracks, prev_track_times)
+
+
+BUILDERS: Dict[str, Callable] = {
+    "random": build_random,
+    "toppop": build_toppop,
+    "sequential": build_sequential,
+    "indexed": build_indexed,
+    "contextual": build_contextual,
+    "sticky_artist": build_sticky_artist,
+    "cascade": build_cascade,
+}
+
+
+def build_recommender(
+    spec: dict, context: RecommenderContext, default_fallback: Recommender = None
+) -> Recommender:
+    """
+    Build a recommender from its config spec, e.g.::
+
+        {"type": "sequential", "recommendations": "RECOMMENDATIONS_DEBIAS_SVD",
+         "fallback": {"type": "random"}}
+
+    Without an explicit ``fallback`` ``default_fallback`` is used,
+    the shared :class:`Random` by default.
+
+    A cascade queries its sources concurrently, each within its
+    budget in seconds; sources fall back to the next one rather
+    than to Random::
+
+        {"type": "cascade", "deadline": 0.05,
+         "sources": [
+           {"type": "sequential", "recommendations": "RECOMMENDATIONS_DEBIAS_SVD",
+            "name": "svd", "budget": 0.03},
+           {"type": "contextual", "budget": 0.04}
+         ],
+         "fallback": {"type": "toppop", "top_tracks": "./data/top_tracks.json"}}
+
+    """
+    if spec["type"] not in BUILDERS:
+        raise ValueError(
+            f"Unknown recommender type: {spec['type']}, expected one of {list(BUILDERS)}"
+        )
+    fallback = (
+        build_recommender(spec["fallback"], context)
+        if "fallback" in spec
+        else default_fallback or context.random
+    )
+    fallback = CountedFallback(
+        fallback, metrics.counter("botify_fallbacks_total", recommender=spec["type"])
+    )
+    return BUILDERS[spec["type"]](spec, context, fallback)
+
+
+class RecommenderRegistry:
+    """
+    Maps every treatment of the serving experiment to a recommender
+    built once at startup, so the request path is a single lookup.
+
+    The arms come from the app config::
+
+        "EXPERIMENT": "DEBIAS",
+        "RECOMMENDERS": {
+          "DEBIAS": {
+            "C": {"type": "sequential", "recommendations": "RECOMMENDATIONS_DEBIAS_SVD"},
+            "T1": {"type": "sequential", "recommendations": "RECOMMENDATIONS_DEBIAS_SVD_IPS"}
+          }
+        }
+
+    """
+
+    def __init__(
+        self,
+        experiment: Experiment,
+        arms: Dict[Treatment, Recommender],
+        experiments: Experiments = None,
+        names: Dict[Treatment, str] = None,
+    ):
+        missing = [
+            Treatment(value).name
+            for value in range(experiment.split.value)
+            if Treatment(value) not in arms
+        ]
+        if missing:
+            raise ValueError(f"No recommender configured for {experiment}: {missing}")
+
+        self.experiment = experiment
+        self.arms = arms
+        self.experiments = experiments or Experiments([experiment])
+        self.names = names or {
+            treatment: type(recommender).__name__
+            for treatment, recommender in arms.items()
+        }
+
+    @staticmethod
+    def from_config(
+        config, context: RecommenderContext, experiments: Experiments = None
+    ) -> "RecommenderRegistry":
+        experiment = getattr(Experiments, config["EXPERIMENT"])
+        specs = {
+            Treatment[treatment]: spec
+            for treatment, spec in config["RECOMMENDERS"][experiment.name].items()
+        }
+        arms = {
+            treatment: build_recommender(spec, context)
+            for treatment, spec in specs.items()
+        }
+        names = {treatment: spec["type"] for treatment, spec in specs.items()}
+        return RecommenderRegistry(experiment, arms, experiments, names)
+
+    def assign(self, user: int) -> Treatment:
+        return self.experiments.treatment(self.experiment, user)
+
+    def get(self, user: int) -> Recommender:
+        return self.arms[self.assign(user)]
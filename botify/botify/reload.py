@@ -0,0 +1,233 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, List
+
+from botify.store import CsrStore, RedisRecommendations
+
+logger = logging.getLogger(__name__)
+
+
+class Reloadable:
+    """
+    A recommendations store whose content can be replaced at runtime
+    without a restart. Delegates reads to the currently active store
+    and notifies ``listeners`` (e.g. caches) after every switch.
+    ``path`` is the recommendations file the active data comes from.
+    """
+
+    def __init__(self, name: str, path: str, poll_interval: float):
+        self.name = name
+        self.path = path
+        self.poll_interval = poll_interval
+        self.next_poll = 0.0
+        self.listeners: List[Callable[[], None]] = []
+        self.reloading = threading.Lock()
+        self.reloaded_at = None
+
+    @property
+    def store(self):
+        now = time.monotonic()
+        if now >= self.next_poll:
+            self.next_poll = now + self.poll_interval
+            self.refresh()
+        return self.current
+
+    def refresh(self):
+        """
+        Pick up a switch made by another process.
+        """
+        raise NotImplementedError()
+
+    def load(self, path: str):
+        """
+        Load ``path`` next to the active data and switch to it.
+        """
+        raise NotImplementedError()
+
+    def reload(self, path: str) -> bool:
+        """
+        Start loading ``path`` in a background thread. Returns False
+        if a reload of this store is already in progress.
+        """
+        if not self.reloading.acquire(blocking=False):
+            return False
+
+        def run():
+            try:
+                start = time.time()
+                self.load(path)
+                self.reloaded_at = time.time()
+                logger.info(
+                    f"Reloaded {self.name} from {path} in {time.time() - start:.1f}s"
+                )
+            except Exception:
+                logger.exception(f"Failed to reload {self.name} from {path}")
+            finally:
+                self.reloading.release()
+
+        threading.Thread(target=run, name=f"reload-{self.name}", daemon=True).start()
+        return True
+
+    def switched(self):
+        for listener in self.listeners:
+            listener()
+
+    def status(self):
+        return {
+            "name": self.name,
+            "path": self.path,
+            "reloading": self.reloading.locked(),
+            "reloaded_at": self.reloaded_at,
+        }
+
+    def get(self, user):
+        return self.store.get(user)
+
+    def get_many(self, users):
+        return self.store.get_many(users)
+
+    def successor(self, user, track):
+        return self.store.successor(user, track)
+
+    def successors(self, users, tracks):
+        return self.store.successors(users, tracks)
+
+    async def aget(self, user):
+        return await self.store.aget(user)
+
+    async def asuccessor(self, user, track):
+        return await self.store.asuccessor(user, track)
+
+
+class DoubleBufferedRecommendations(Reloadable):
+    """
+    Recommendations served from one of two dedicated redis DBs.
+    The index of the active DB is kept in redis (``botify:active:<name>``)
+    so that every worker and replica reads from the same one, next to
+    the file it was loaded from (``botify:active_path:<name>``), so that
+    restarts upload the reloaded file rather than the configured one.
+
+    A reload fills the inactive (shadow) DB, flips the pointer,
+    waits ``grace_period`` seconds for in-flight reads and workers
+    polling the pointer, and then empties the old DB. Both DBs are
+    flushed during reloads, so they must not hold anything else.
+
+    Reads go through ``wrap(connection)`` (e.g. a cache), reloads
+    write to the connections directly.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        path: str,
+        connections,
+        pointer_redis,
+        upload: Callable,
+        poll_interval: float = 1.0,
+        grace_period: float = 5.0,
+        wrap: Callable = None,
+    ):
+        super().__init__(name, path, poll_interval)
+        self.configured_path = path
+        self.connections = connections
+        self.stores = [
+            RedisRecommendations(wrap(connection) if wrap else connection)
+            for connection in connections
+        ]
+        self.pointer_redis = pointer_redis
+        self.pointer = f"botify:active:{name}"
+        self.path_key = f"botify:active_path:{name}"
+        self.upload = upload
+        self.grace_period = grace_period
+        self.active = None
+        self.refresh()
+
+    def refresh(self):
+        pointer, path = self.pointer_redis.mget(self.pointer, self.path_key)
+        active = int(pointer) if pointer is not None else 0
+        self.path = path.decode() if path is not None else self.configured_path
+        if active != self.active:
+            self.active = active
+            self.current = self.stores[active]
+            self.switched()
+
+    @property
+    def active_connection(self):
+        return self.connections[self.active]
+
+    def load(self, path: str):
+        with self.pointer_redis.lock(f"botify:reload:{self.name}", timeout=3600):
+            self.refresh()
+            old, new = self.active, 1 - self.active
+            shadow = self.connections[new]
+
+            shadow.flushdb()
+            self.upload(shadow, path)
+            self.pointer_redis.mset({self.pointer: new, self.path_key: path})
+            self.refresh()
+
+            time.sleep(self.grace_period)
+            self.connections[old].flushdb()
+
+
+class ReloadableCsrStore(Reloadable):
+    """
+    A :class:`CsrStore` reopened whenever its file is replaced. Reloads
+    compile the new recommendations next to the file and atomically
+    rename it, other workers notice the new file on their next poll.
+    The file it was compiled from is kept next to it (``<csr>.source``)
+    for other workers and restarts, unless it was rebuilt since from
+    the configured file.
+    """
+
+    def __init__(self, name: str, recommendations_path: str, poll_interval: float):
+        super().__init__(name, recommendations_path, poll_interval)
+        self.configured_path = recommendations_path
+        self.current = CsrStore.open(recommendations_path)
+        self.mtime = os.stat(self.current.path).st_mtime_ns
+        self.source = f"{self.current.path}.source"
+        self.source_mtime = modified(self.source)
+        if self.source_mtime >= self.mtime:
+            self.path = self.read_source()
+
+    def refresh(self):
+        mtime = os.stat(self.current.path).st_mtime_ns
+        if mtime != self.mtime:
+            self.current = CsrStore(self.current.path)
+            self.mtime = mtime
+            if self.source_mtime < mtime:
+                # rebuilt from the configured file, or the source of
+                # a reload is about to be written
+                self.path = self.configured_path
+            self.switched()
+        source_mtime = modified(self.source)
+        if source_mtime != self.source_mtime:
+            self.source_mtime = source_mtime
+            self.path = self.read_source()
+
+    def read_source(self) -> str:
+        try:
+            with open(self.source) as f:
+                return f.read()
+        except FileNotFoundError:
+            return self.configured_path
+
+    def load(self, path: str):
+        CsrStore.build(path, self.current.path)
+        tmp_path = f"{self.source}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(path)
+        os.replace(tmp_path, self.source)
+        self.refresh()
+
+
+def modified(path: str) -> int:
+    """
+    Modification time of a file in ns, -1 if it doesn't exist.
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return -1
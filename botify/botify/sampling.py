@@ -0,0 +1,89 @@
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+
+class AliasTable:
+    """
+    Walker's alias method: after O(n) preprocessing of the weights,
+    every weighted draw costs one uniform index and one coin flip.
+    """
+
+    def __init__(self, weights: Sequence[float]):
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.ndim != 1 or not len(weights):
+            raise ValueError("Weights must be a non-empty 1d sequence")
+        if (weights < 0).any() or not weights.sum() > 0:
+            raise ValueError("Weights must be non-negative with a positive sum")
+
+        n = len(weights)
+        scaled = weights * n / weights.sum()
+        self.prob = np.ones(n, dtype=np.float64)
+        self.alias = np.arange(n, dtype=np.int64)
+
+        small = [ix for ix in range(n) if scaled[ix] < 1.0]
+        large = [ix for ix in range(n) if scaled[ix] >= 1.0]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] -= 1.0 - scaled[less]
+            (small if scaled[more] < 1.0 else large).append(more)
+        # whatever is left is 1 up to rounding errors
+
+    def __len__(self):
+        return len(self.prob)
+
+    def draw(self, size: int) -> np.ndarray:
+        """
+        Returns ``size`` indices drawn proportionally to the weights.
+        """
+        ix = np.random.randint(0, len(self.prob), size)
+        return np.where(np.random.random(size) < self.prob[ix], ix, self.alias[ix])
+
+
+class BatchSampler:
+    """
+    Samples items of a fixed population, uniformly or proportionally
+    to ``weights`` through an :class:`AliasTable`. Random draws are
+    made by numpy in batches of ``batch_size`` and served one by one,
+    so a single sample is a step of a list iterator, which is atomic,
+    so the sampler is safe to share between threads without a lock.
+    """
+
+    def __init__(
+        self,
+        items: Sequence[int],
+        weights: Optional[Sequence[float]] = None,
+        batch_size: int = 4096,
+    ):
+        self.items = np.asarray(items)
+        if not len(self.items):
+            raise ValueError("Can't sample from an empty population")
+
+        self.table = None
+        if weights is not None:
+            if len(weights) != len(self.items):
+                raise ValueError("Items and weights must have the same length")
+            self.table = AliasTable(weights)
+
+        self.batch_size = batch_size
+        self.batch = iter(())
+
+    def sample(self) -> int:
+        while True:
+            try:
+                return next(self.batch)
+            except StopIteration:
+                self.refill()
+
+    def sample_many(self, size: int) -> List[int]:
+        return self.items[self.draw(size)].tolist()
+
+    def draw(self, size: int) -> np.ndarray:
+        if self.table is not None:
+            return self.table.draw(size)
+        return np.random.randint(0, len(self.items), size)
+
+    def refill(self):
+        self.batch = iter(self.items[self.draw(self.batch_size)].tolist())
@@ -1,51 +1,160 @@
+import argparse
+import hmac
 import json
 import logging
+import os
 import random
 import time
 from dataclasses import asdict
 from datetime import datetime
 
-from flask import Flask
+from flask import Flask, Response, request
 from flask_redis import Redis
 from flask_restful import Resource, Api, abort, reqparse
 from gevent.pywsgi import WSGIServer
 
+from botify.cache import CachedRedis
 from botify.data import DataLogger, Datum
-from botify.experiment import Experiments, Treatment
-from botify.recommenders.random import Random
-from botify.recommenders.sticky_artist import StickyArtist
-from botify.recommenders.toppop import TopPop
-from botify.recommenders.indexed import Indexed
+from botify.experiment import Experiments
+from botify.metrics import InstrumentedRedis, metrics
+from botify.prefork import Supervisor
+from botify.registry import RecommenderContext, RecommenderRegistry
+from botify.reload import DoubleBufferedRecommendations, ReloadableCsrStore
+from botify.session import SessionStore
+from botify.store import RedisRecommendations
+from botify.sync import renewed_lock
 from botify.track import Catalog
 
-from recommenders.sequential import Sequential
-
 root = logging.getLogger()
 root.setLevel("INFO")
 
 app = Flask(__name__)
 app.config.from_file("config.json", load=json.load)
+# settings of a particular run, e.g. a benchmark, on top of config.json
+if "BOTIFY_CONFIG" in os.environ:
+    app.config.from_file(os.environ["BOTIFY_CONFIG"], load=json.load)
 api = Api(app)
 
-tracks_redis = Redis(app, config_prefix="REDIS_TRACKS")
-artists_redis = Redis(app, config_prefix="REDIS_ARTIST")
+# config prefix -> connection, the ASGI app adds async clients to them
+connections = {}
+
+
+def connect(config_prefix: str, db: str) -> InstrumentedRedis:
+    connection = InstrumentedRedis(
+        Redis(app, config_prefix=config_prefix).connection, db, metrics
+    )
+    connections[config_prefix] = connection
+    return connection
 
-recommendations_svd = Redis(app, config_prefix="REDIS_RECOMMENDATIONS_DEBIAS_SVD")
-recommendations_svd_ips = Redis(app, config_prefix="REDIS_RECOMMENDATIONS_DEBIAS_SVD_IPS")
 
-data_logger = DataLogger(app)
+tracks_redis = connect("REDIS_TRACKS", "tracks")
+artists_redis = connect("REDIS_ARTIST", "artists")
+
+experiments = Experiments(cache_size=app.config["EXPERIMENTS_CACHE_SIZE"])
+data_logger = DataLogger(app, experiments)
 
 catalog = Catalog(app).load(app.config["TRACKS_CATALOG"])
-catalog.upload_tracks(tracks_redis.connection)
-catalog.upload_artists(artists_redis.connection)
-catalog.upload_recommendations(
-    recommendations_svd.connection, "RECOMMENDATIONS_DEBIAS_SVD_FILE_PATH"
-)
-catalog.upload_recommendations(
-    recommendations_svd_ips.connection, "RECOMMENDATIONS_DEBIAS_SVD_IPS_FILE_PATH"
+
+
+def cached(connection, db: str):
+    """
+    Put a read-through cache in front of a connection used by the
+    recommenders, unless REDIS_CACHE_SIZE is 0. Uploads go to the
+    connection itself.
+    """
+    if not app.config["REDIS_CACHE_SIZE"]:
+        return connection
+    return CachedRedis(
+        connection,
+        db,
+        metrics,
+        app.config["REDIS_CACHE_SIZE"],
+        app.config["REDIS_CACHE_TTL"],
+        catalog.from_bytes,
+    )
+
+
+sessions = SessionStore(
+    connect("REDIS_SESSIONS", "sessions"),
+    app.config["SESSION_TTL"],
+    app.config["SESSION_BITS"],
+    app.config["SESSION_HASHES"],
 )
 
-top_tracks = TopPop.load_from_json("./data/top_tracks.json")
+tracks_cache = cached(tracks_redis, "tracks")
+artists_cache = cached(artists_redis, "artists")
+for name, cache in [("tracks", tracks_cache), ("artists", artists_cache)]:
+    if isinstance(cache, CachedRedis):
+        catalog.listeners[name].append(cache.invalidate)
+
+
+reloadable = {}
+
+
+def recommendations_store(name: str):
+    """
+    Returns the store serving precomputed recommendations ``name``:
+    a redis DB filled from the recommendations file or, with the "csr"
+    RECOMMENDATIONS_BACKEND, a memory-mapped file compiled from it.
+
+    Stores are reloadable at runtime if they are memory-mapped or
+    have a shadow redis DB configured (``REDIS_<name>_SHADOW_*``).
+    """
+    poll_interval = app.config["RELOAD_POLL_INTERVAL"]
+    if app.config["RECOMMENDATIONS_BACKEND"] == "csr":
+        store = ReloadableCsrStore(
+            name, app.config[f"{name}_FILE_PATH"], poll_interval
+        )
+        reloadable[name] = store
+        return store
+
+    redis = connect(f"REDIS_{name}", name.lower())
+    if f"REDIS_{name}_SHADOW_DB" not in app.config:
+        catalog.upload_recommendations(redis, f"{name}_FILE_PATH")
+        return RedisRecommendations(cached(redis, name.lower()))
+
+    shadow = connect(f"REDIS_{name}_SHADOW", f"{name.lower()}_shadow")
+
+    def upload(connection, path):
+        catalog.upload_recommendations(connection, f"{name}_FILE_PATH", path=path)
+
+    store = DoubleBufferedRecommendations(
+        name,
+        app.config[f"{name}_FILE_PATH"],
+        [redis, shadow],
+        tracks_redis.connection,
+        upload,
+        poll_interval,
+        app.config["RELOAD_GRACE_PERIOD"],
+        lambda connection: cached(connection, connection.db),
+    )
+    for read in store.stores:
+        if isinstance(read.connection, CachedRedis):
+            store.listeners.append(read.connection.clear)
+    if not os.path.exists(store.path):
+        app.logger.warning(f"Reloaded {store.path} is gone, uploading {name} as configured")
+        store.path = store.configured_path
+    upload(store.active_connection, store.path)
+    reloadable[name] = store
+    return store
+
+
+# Replicas sharing a redis seed it one after another, never concurrently
+with renewed_lock(tracks_redis, "botify:seeding", app.config["SEEDING_LOCK_TIMEOUT"]):
+    catalog.upload_tracks(tracks_redis)
+    catalog.upload_artists(artists_redis)
+
+    registry = RecommenderRegistry.from_config(
+        app.config,
+        RecommenderContext(
+            catalog,
+            tracks_cache,
+            artists_cache,
+            recommendations_store,
+            sessions,
+        ),
+        experiments,
+    )
 
 parser = reqparse.RequestParser()
 parser.add_argument("track", type=int, location="json", required=True)
@@ -62,47 +171,151 @@ class Hello(Resource):
 
 class Track(Resource):
     def get(self, track: int):
-        data = tracks_redis.connection.get(track)
+        data = tracks_cache.get(track)
         if data is not None:
             return asdict(catalog.from_bytes(data))
         else:
             abort(404, description="Track not found")
 
 
+class Tracks(Resource):
+    """
+    Metadata of several tracks in one call, read with a single MGET:
+    ``GET /tracks?ids=1,2,3`` or ``POST /tracks`` with ``{"ids": [1, 2, 3]}``.
+    Tracks that are not in the catalog are listed in ``missing``.
+    """
+
+    def get(self):
+        ids = ",".join(request.args.getlist("ids")).split(",")
+        return self.lookup([track for track in ids if track])
+
+    def post(self):
+        body = request.get_json(force=True, silent=True)
+        if not isinstance(body, dict) or not isinstance(body.get("ids", []), list):
+            abort(400, description='The body must be {"ids": [...]}')
+        return self.lookup(body.get("ids", []))
+
+    def lookup(self, ids):
+        try:
+            ids = [int(track) for track in ids]
+        except (TypeError, ValueError):
+            abort(400, description="Track ids must be integers")
+        if len(ids) > app.config["TRACKS_BATCH_LIMIT"]:
+            abort(
+                400,
+                description=f"At most {app.config['TRACKS_BATCH_LIMIT']} ids per call",
+            )
+
+        tracks, missing = [], []
+        for track, data in zip(ids, tracks_cache.mget(ids) if ids else []):
+            if data is not None:
+                tracks.append(asdict(catalog.from_bytes(data)))
+            else:
+                missing.append(track)
+        return {"tracks": tracks, "missing": missing}
+
+
 class NextTrack(Resource):
     def post(self, user: int):
         start = time.time()
 
-        args = parser.parse_args()
+        with metrics.timer("botify_stage_seconds", stage="parse"):
+            args = parser.parse_args()
 
-        fallback = Random(tracks_redis.connection)
-        treatment = Experiments.DEBIAS.assign(user)
+        with metrics.timer("botify_stage_seconds", stage="assignment"):
+            treatment = registry.assign(user)
 
-        if treatment == Treatment.T1:
-            recommender = Sequential(recommendations_svd_ips.connection, catalog, fallback)
-        else:
-            recommender = Sequential(recommendations_svd.connection, catalog, fallback)
+        # the previous track counts as played when recommending the next one
+        with metrics.timer("botify_stage_seconds", stage="session"):
+            sessions.played(user, args.track)
 
-        recommendation = recommender.recommend_next(user, args.track, args.time)
+        with metrics.timer(
+            "botify_recommend_seconds",
+            recommender=registry.names[treatment],
+            treatment=treatment.name,
+        ):
+            recommendation = registry.arms[treatment].recommend_next(
+                user, args.track, args.time
+            )
 
-        data_logger.log(
-            "next",
-            Datum(
-                int(datetime.now().timestamp() * 1000),
-                user,
-                args.track,
-                args.time,
-                time.time() - start,
-                recommendation,
-            ),
+        with metrics.timer("botify_stage_seconds", stage="logging"):
+            data_logger.log(
+                "next",
+                Datum(
+                    int(datetime.now().timestamp() * 1000),
+                    user,
+                    args.track,
+                    args.time,
+                    time.time() - start,
+                    recommendation,
+                ),
+            )
+        metrics.histogram("botify_request_seconds", endpoint="next").observe(
+            time.time() - start
         )
         return {"user": user, "track": recommendation}
 
 
+class NextTrackBatch(Resource):
+    """
+    Recommend next tracks for a list of ``{"user", "track", "time"}``
+    items at once. Items are grouped by recommender so that each
+    group's lookups go to redis in a single round trip.
+    """
+
+    def post(self):
+        start = time.time()
+
+        try:
+            items = [
+                (int(item["user"]), int(item["track"]), float(item["time"]))
+                for item in request.get_json(force=True)["items"]
+            ]
+        except (KeyError, TypeError, ValueError):
+            abort(400, description="Each item needs a user, a track and a time")
+
+        sessions.played_many(
+            [user for user, _, _ in items], [track for _, track, _ in items]
+        )
+
+        groups = {}
+        for ix, (user, _, _) in enumerate(items):
+            recommender = registry.get(user)
+            groups.setdefault(id(recommender), (recommender, []))[1].append(ix)
+
+        recommendations = [None] * len(items)
+        for recommender, positions in groups.values():
+            users, tracks, times = zip(*[items[ix] for ix in positions])
+            batch = recommender.recommend_next_batch(
+                list(users), list(tracks), list(times)
+            )
+            for ix, recommendation in zip(positions, batch):
+                recommendations[ix] = recommendation
+
+        timestamp = int(datetime.now().timestamp() * 1000)
+        latency = time.time() - start
+        for (user, track, track_time), recommendation in zip(items, recommendations):
+            data_logger.log(
+                "next",
+                Datum(timestamp, user, track, track_time, latency, recommendation),
+            )
+
+        metrics.histogram("botify_request_seconds", endpoint="next_batch").observe(
+            time.time() - start
+        )
+        return {
+            "items": [
+                {"user": user, "track": recommendation}
+                for (user, _, _), recommendation in zip(items, recommendations)
+            ]
+        }
+
+
 class LastTrack(Resource):
     def post(self, user: int):
         start = time.time()
         args = parser.parse_args()
+        sessions.end(user)
         data_logger.log(
             "last",
             Datum(
@@ -113,16 +326,112 @@ class LastTrack(Resource):
                 time.time() - start,
             ),
         )
+        metrics.histogram("botify_request_seconds", endpoint="last").observe(
+            time.time() - start
+        )
         return {"user": user}
 
 
+def authorize_admin():
+    """
+    Admin endpoints are disabled unless ADMIN_TOKEN is set and must
+    be called with an ``Authorization: Bearer <ADMIN_TOKEN>`` header.
+    """
+    token = app.config["ADMIN_TOKEN"]
+    if not token:
+        abort(403, description="Admin endpoints are disabled")
+    if not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        abort(401, description="Invalid admin token")
+
+
+def data_file(path: str) -> str:
+    """
+    Returns ``path`` if it is an existing file under RELOAD_DATA_DIR
+    (symlinks placed there by the operator are followed).
+    """
+    data_dir = os.path.abspath(app.config["RELOAD_DATA_DIR"])
+    full_path = os.path.abspath(path)
+    if os.path.commonpath([data_dir, full_path]) != data_dir:
+        abort(400, description=f"File {path} is not in {app.config['RELOAD_DATA_DIR']}")
+    if not os.path.isfile(full_path):
+        abort(400, description=f"File {path} does not exist")
+    return path
+
+
+class Reload(Resource):
+    """
+    Load a new recommendations file into a reloadable store in the
+    background and switch to it once it is complete. The file path
+    defaults to the one the active data was loaded from, so a file
+    updated in place is reloaded with an empty body.
+    """
+
+    def get(self, name: str):
+        authorize_admin()
+        if name not in reloadable:
+            abort(404, description="No reloadable recommendations with this name")
+        return reloadable[name].status()
+
+    def post(self, name: str):
+        authorize_admin()
+        if name not in reloadable:
+            abort(404, description="No reloadable recommendations with this name")
+        body = request.get_json(force=True, silent=True)
+        if not isinstance(body, dict):
+            body = {}
+        path = data_file(body.get("path") or reloadable[name].path)
+        if not reloadable[name].reload(path):
+            abort(409, description="Reload is already in progress")
+        return {"name": name, "path": path}, 202
+
+
+class Metrics(Resource):
+    def get(self):
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+for state in ["enqueued", "dropped", "flushed", "failed", "queued"]:
+    metrics.gauge(
+        "botify_data_log_events",
+        lambda state=state: data_logger.stats()[state],
+        state=state,
+    )
+
 api.add_resource(Hello, "/")
+api.add_resource(Metrics, "/metrics")
 api.add_resource(Track, "/track/<int:track>")
+api.add_resource(Tracks, "/tracks")
 api.add_resource(NextTrack, "/next/<int:user>")
+api.add_resource(NextTrackBatch, "/next_batch")
 api.add_resource(LastTrack, "/last/<int:user>")
+api.add_resource(Reload, "/admin/reload/<string:name>")
+
+# count only the requests served, not the startup sync and seeding
+metrics.reset()
 
 app.logger.info(f"Botify service stared")
 
+
+def on_worker_start(worker: int):
+    data_logger.worker = worker
+    metrics.labels["worker"] = worker
+
+
 if __name__ == "__main__":
-    http_server = WSGIServer(("", 5001), app)
-    http_server.serve_forever()
+    cli = argparse.ArgumentParser()
+    cli.add_argument("--port", type=int, default=5001)
+    cli.add_argument(
+        "--workers",
+        type=int,
+        default=app.config["SERVER_WORKERS"],
+        help="Number of pre-forked worker processes, 0 for one per core",
+    )
+    cli_args = cli.parse_args()
+
+    if cli_args.workers == 1:
+        http_server = WSGIServer(("", cli_args.port), app)
+        http_server.serve_forever()
+    else:
+        Supervisor(app, cli_args.port, cli_args.workers, on_worker_start).run()
@@ -0,0 +1,306 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import Dict, List, Optional
+
+import numpy as np
+
+MAGIC = b"BOTICSR2"
+
+# hash field holding the successor of tracks that are not in the list
+UNKNOWN_TRACK = "*"
+
+# magic, number of user slots, number of tracks
+HEADER = struct.Struct("<8sQQ")
+
+# the index has a slot per user ID up to the largest one, so IDs
+# sparser than this many slots per user are rejected
+MAX_SLOTS_PER_USER = 8
+
+
+def successors_key(user) -> str:
+    return f"{user}:next"
+
+
+def successors(tracks: List[int]) -> Dict:
+    """
+    Map every track of the list to the one following it (wrapping
+    around at the end). A track that occurs several times maps to the
+    successor of its first occurrence; a track that is not in the list
+    maps to the second item, as if it was found at the first position.
+    """
+    mapping = {UNKNOWN_TRACK: tracks[1 % len(tracks)]}
+    for ix in reversed(range(len(tracks))):
+        mapping[tracks[ix]] = tracks[(ix + 1) % len(tracks)]
+    return mapping
+
+
+class RedisRecommendations:
+    """
+    Precomputed recommendations stored in a redis DB by
+    :meth:`botify.track.Catalog.upload_recommendations`.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def get(self, user):
+        return self.connection.get(user)
+
+    def successor(self, user: int, track: int) -> Optional[int]:
+        """
+        Returns the recommendation following ``track`` in the user's
+        list in a single HMGET, or None if the user has no list.
+        """
+        known, unknown = self.connection.hmget(
+            successors_key(user), track, UNKNOWN_TRACK
+        )
+        if unknown is None:
+            return None
+        return int(known if known is not None else unknown)
+
+    def get_many(self, users: List[int]) -> List:
+        return self.connection.mget(users) if users else []
+
+    async def aget(self, user):
+        return await self.connection.aget(user)
+
+    async def asuccessor(self, user: int, track: int) -> Optional[int]:
+        known, unknown = await self.connection.ahmget(
+            successors_key(user), track, UNKNOWN_TRACK
+        )
+        if unknown is None:
+            return None
+        return int(known if known is not None else unknown)
+
+    def successors(self, users: List[int], tracks: List[int]) -> List[Optional[int]]:
+        """
+        Batched :meth:`successor` with all the HMGETs in one pipeline.
+        """
+        pipeline = self.connection.pipeline(transaction=False)
+        for user, track in zip(users, tracks):
+            pipeline.hmget(successors_key(user), track, UNKNOWN_TRACK)
+        return [
+            None if unknown is None else int(known if known is not None else unknown)
+            for known, unknown in pipeline.execute()
+        ]
+
+
+class CsrStore:
+    """
+    Read-only store of precomputed recommendations backed by
+    a memory-mapped CSR file: a flat int32 array of tracks and
+    int64 start/end offsets into it, addressed by user ID.
+
+    Serves the same ``get`` and ``successor`` calls as
+    :class:`RedisRecommendations`, so it can be passed to the
+    recommenders instead of a recommendations DB. Successors are
+    found by a binary search in the per-user sorted copy of the list.
+    Values are returned as zero-copy numpy views which
+    :meth:`botify.track.Catalog.from_bytes` passes through as is.
+    All processes that open the same file share one page-cached copy.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, slots, size = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a recommendations CSR file: {path}")
+
+        self.tracks = np.frombuffer(
+            self.buffer, dtype="<i4", count=size, offset=HEADER.size
+        )
+        index = index_position(size)
+        self.starts = np.frombuffer(
+            self.buffer, dtype="<i8", count=slots, offset=index
+        )
+        self.ends = np.frombuffer(
+            self.buffer, dtype="<i8", count=slots, offset=index + 8 * slots
+        )
+        self.sorted_tracks = np.frombuffer(
+            self.buffer, dtype="<i4", count=size, offset=index + 16 * slots
+        )
+        self.positions = np.frombuffer(
+            self.buffer,
+            dtype="<i4",
+            count=size,
+            offset=index + 16 * slots + 4 * size,
+        )
+        self.slots = slots
+
+    def get(self, user):
+        user = int(user)
+        if user < 0 or user >= self.slots:
+            return None
+        start, end = self.starts[user], self.ends[user]
+        if start == end:
+            return None
+        return self.tracks[start:end]
+
+    def successor(self, user: int, track: int) -> Optional[int]:
+        user = int(user)
+        if user < 0 or user >= self.slots:
+            return None
+        start, end = self.starts[user], self.ends[user]
+        if start == end:
+            return None
+
+        keys = self.sorted_tracks[start:end]
+        ix = keys.searchsorted(track)
+        found = ix < len(keys) and keys[ix] == track
+        position = self.positions[start + ix] if found else 0
+        return int(self.tracks[start + (position + 1) % (end - start)])
+
+    def get_many(self, users: List[int]) -> List:
+        return [self.get(user) for user in users]
+
+    def successors(self, users: List[int], tracks: List[int]) -> List[Optional[int]]:
+        return [self.successor(user, track) for user, track in zip(users, tracks)]
+
+    # lookups don't wait for I/O, the async API just returns their results
+
+    async def aget(self, user):
+        return self.get(user)
+
+    async def asuccessor(self, user: int, track: int) -> Optional[int]:
+        return self.successor(user, track)
+
+    def __len__(self):
+        return int(np.count_nonzero(self.ends - self.starts))
+
+    @staticmethod
+    def build(
+        recommendations_path: str,
+        csr_path: str,
+        key_object: str = "user",
+        key_recommendations: str = "tracks",
+    ) -> int:
+        """
+        Compile a ``recommendations_*.json`` file into a CSR file.
+        Tracks are streamed to disk in file order, only the per-user
+        offsets are kept in memory. Returns the number of users written.
+
+        User IDs must be non-negative and dense enough to be addressed
+        directly (see ``MAX_SLOTS_PER_USER``), otherwise ValueError
+        is raised. The file is written to a temporary file next to
+        ``csr_path`` and renamed, so concurrent builds don't clash.
+        """
+        out = tempfile.NamedTemporaryFile(
+            "wb",
+            dir=os.path.dirname(os.path.abspath(csr_path)),
+            prefix=os.path.basename(csr_path) + ".",
+            suffix=".tmp",
+            delete=False,
+        )
+        try:
+            with out:
+                users = CsrStore.write(
+                    recommendations_path, out, key_object, key_recommendations
+                )
+            os.chmod(out.name, 0o644)
+            os.replace(out.name, csr_path)
+        except BaseException:
+            os.unlink(out.name)
+            raise
+        return users
+
+    @staticmethod
+    def write(
+        recommendations_path: str, out, key_object: str, key_recommendations: str
+    ) -> int:
+        """
+        Write the CSR layout of a recommendations file to ``out``.
+        """
+        users, offsets = [], [0]
+        with open(recommendations_path) as rf:
+            out.write(HEADER.pack(MAGIC, 0, 0))
+            for line_number, line in enumerate(rf, 1):
+                recommendations = json.loads(line)
+                user = recommendations[key_object]
+                if not isinstance(user, int) or user < 0:
+                    raise ValueError(
+                        f"{recommendations_path}:{line_number}: "
+                        f"{key_object} must be a non-negative integer, got {user!r}"
+                    )
+                tracks = np.asarray(
+                    recommendations[key_recommendations], dtype="<i4"
+                )
+                out.write(tracks.tobytes())
+                users.append(user)
+                offsets.append(offsets[-1] + len(tracks))
+
+            size = offsets[-1]
+            slots = max(users) + 1 if users else 0
+            if slots > max(MAX_SLOTS_PER_USER * len(users), 1 << 16):
+                raise ValueError(
+                    f"{recommendations_path}: {key_object} IDs up to {slots - 1} "
+                    f"are too sparse for {len(users)} users"
+                )
+            starts = np.zeros(slots, dtype="<i8")
+            ends = np.zeros(slots, dtype="<i8")
+            starts[users] = offsets[:-1]
+            ends[users] = offsets[1:]
+
+            out.write(b"\0" * (index_position(size) - out.tell()))
+            out.write(starts.tobytes())
+            out.write(ends.tobytes())
+
+            # sort every user's segment by track, ties by position, so that
+            # a binary search finds the first occurrence of a track
+            out.flush()
+            tracks = np.fromfile(
+                out.name, dtype="<i4", count=size, offset=HEADER.size
+            )
+            segments = np.repeat(np.arange(len(users)), np.diff(offsets))
+            order = np.lexsort((tracks, segments))
+            positions = order - np.asarray(offsets[:-1])[segments]
+            out.write(tracks[order].tobytes())
+            out.write(positions.astype("<i4").tobytes())
+            out.seek(0)
+            out.write(HEADER.pack(MAGIC, slots, size))
+        return len(users)
+
+    @staticmethod
+    def open(recommendations_path: str) -> "CsrStore":
+        """
+        Open the CSR file compiled from the given recommendations file,
+        (re)building it if it is missing or older than the source.
+        """
+        csr_path = os.path.splitext(recommendations_path)[0] + ".csr"
+        if os.path.exists(csr_path) and os.path.getmtime(
+            csr_path
+        ) >= os.path.getmtime(recommendations_path):
+            try:
+                return CsrStore(csr_path)
+            except ValueError:
+                pass  # written by an older layout version
+        CsrStore.build(recommendations_path, csr_path)
+        return CsrStore(csr_path)
+
+
+def index_position(size: int) -> int:
+    # keep int64 offsets 8-byte aligned
+    end = HEADER.size + 4 * size
+    return end + (-end) % 8
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compile recommendations json into a CSR file"
+    )
+    parser.add_argument("recommendations", type=str)
+    parser.add_argument("csr", type=str)
+    args = parser.parse_args()
+
+    users = CsrStore.build(args.recommendations, args.csr)
+    print(f"Wrote recommendations for {users} users to {args.csr}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import logging
+import threading
+from contextlib import contextmanager
+
+from redis.exceptions import LockError
+
+logger = logging.getLogger(__name__)
+
+# bump when the way values are derived from source files changes
+SYNC_VERSION = 1
+
+
+def fingerprint_key(name: str) -> str:
+    return f"botify:sync:{name}"
+
+
+def digests_key(name: str) -> str:
+    return f"botify:digests:{name}"
+
+
+def fingerprint(path: str, **params) -> str:
+    """
+    Hash of a source file's content and of the parameters used
+    to turn it into redis values.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    h.update(json.dumps([SYNC_VERSION, params], sort_keys=True).encode())
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def digest(value) -> bytes:
+    """
+    Short digest of a redis value, a hash value is digested
+    with its fields sorted.
+    """
+    if isinstance(value, dict):
+        value = repr(sorted((str(k), str(v)) for k, v in value.items())).encode()
+    return hashlib.blake2b(value, digest_size=8).digest()
+
+
+@contextmanager
+def renewed_lock(redis, name: str, timeout: float):
+    """
+    Hold a redis lock for as long as the block runs, however long
+    it takes: the lock is renewed every ``timeout / 3`` seconds in
+    the background, so it only expires ``timeout`` seconds after
+    its holder has died.
+    """
+    lock = redis.lock(name, timeout=timeout, thread_local=False)
+    with lock:
+        done = threading.Event()
+
+        def renew():
+            while not done.wait(timeout / 3):
+                try:
+                    lock.reacquire()
+                except LockError:
+                    logger.exception(f"Lost the {name} lock")
+                    return
+
+        renewer = threading.Thread(target=renew, name=f"renew-{name}", daemon=True)
+        renewer.start()
+        try:
+            yield lock
+        finally:
+            done.set()
+            renewer.join()
@@ -1,8 +1,17 @@
 import itertools
 import json
-import pickle
+import random
+import time
+from array import array
+from collections import defaultdict
 from dataclasses import dataclass, field
-from typing import List
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from botify.metrics import metrics
+from botify.store import successors, successors_key
+from botify.sync import digest, digests_key, fingerprint, fingerprint_key
 
 
 @dataclass
@@ -10,75 +19,384 @@ class Track:
     track: int
     artist: str
     title: str
-    recommendations: List[int] = field(default=lambda: [])
+    recommendations: List[int] = field(default_factory=list)
+
+
+class TrackColumns:
+    """
+    Track metadata stored column-wise: numpy arrays for track IDs
+    and artist codes, titles in one utf-8 buffer and recommendations
+    in one int32 array, both addressed by offsets. Indexing or
+    iterating builds :class:`Track` objects on the fly.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        artist_codes: np.ndarray,
+        artists: List[str],
+        titles: bytes,
+        title_offsets: np.ndarray,
+        recommendations: np.ndarray,
+        recommendation_offsets: np.ndarray,
+    ):
+        self.ids = ids
+        self.artist_codes = artist_codes
+        self.artists = artists
+        self.titles = titles
+        self.title_offsets = title_offsets
+        self.recommendations = recommendations
+        self.recommendation_offsets = recommendation_offsets
+
+    @staticmethod
+    def read(lines: Iterable[str]) -> "TrackColumns":
+        """
+        Stream json lines into growable typed arrays, so no per-track
+        python objects outlive the line they were parsed from.
+        """
+        ids = array("q")
+        artist_codes = array("i")
+        artist_index = {}
+        titles = bytearray()
+        title_offsets = array("q", [0])
+        recommendations = array("i")
+        recommendation_offsets = array("q", [0])
+
+        for line in lines:
+            data = json.loads(line)
+            ids.append(data["track"])
+            artist_codes.append(
+                artist_index.setdefault(data["artist"], len(artist_index))
+            )
+            titles += data["title"].encode("utf-8")
+            title_offsets.append(len(titles))
+            recommendations.extend(data.get("recommendations", []))
+            recommendation_offsets.append(len(recommendations))
+
+        return TrackColumns(
+            np.frombuffer(ids, dtype=np.int64),
+            np.frombuffer(artist_codes, dtype=np.int32),
+            list(artist_index),
+            bytes(titles),
+            np.frombuffer(title_offsets, dtype=np.int64),
+            np.frombuffer(recommendations, dtype=np.int32),
+            np.frombuffer(recommendation_offsets, dtype=np.int64),
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, ix: int) -> Track:
+        title_start, title_end = self.title_offsets[ix : ix + 2]
+        start, end = self.recommendation_offsets[ix : ix + 2]
+        return Track(
+            int(self.ids[ix]),
+            self.artists[self.artist_codes[ix]],
+            self.titles[title_start:title_end].decode("utf-8"),
+            self.recommendations[start:end].tolist(),
+        )
+
+    def __iter__(self):
+        return (self[ix] for ix in range(len(self)))
+
+    def by_artist(
+        self, index: "ArtistIndex" = None
+    ) -> Iterable[Tuple[str, np.ndarray]]:
+        """
+        Yields every artist with the IDs of their tracks in catalog order,
+        read from ``index`` if one is already built for these tracks.
+        """
+        index = index or ArtistIndex(self)
+        for code, artist in enumerate(self.artists):
+            yield artist, index.tracks[index.offsets[code] : index.offsets[code + 1]]
+
+
+class ArtistIndex:
+    """
+    In-memory artist lookups: a table of artist codes addressed by
+    track ID and the track IDs grouped by artist, the tracks of
+    artist ``code`` being ``tracks[offsets[code]:offsets[code + 1]]``.
+    """
+
+    def __init__(self, columns: TrackColumns):
+        if len(columns.ids) and columns.ids.min() < 0:
+            raise ValueError(
+                f"Track IDs must be non-negative, got {int(columns.ids.min())}"
+            )
+        counts = np.bincount(columns.artist_codes, minlength=len(columns.artists))
+        self.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        # a stable argsort of small ints, not of the tracks themselves
+        self.tracks = columns.ids[np.argsort(columns.artist_codes, kind="stable")]
+
+        slots = int(columns.ids.max()) + 1 if len(columns.ids) else 0
+        self.artist_codes = np.full(slots, -1, dtype=np.int32)
+        self.artist_codes[columns.ids] = columns.artist_codes
+
+    def artist(self, track: int) -> int:
+        """
+        Returns the artist code of a track, or -1 for an unknown track.
+        """
+        if 0 <= track < len(self.artist_codes):
+            return int(self.artist_codes[track])
+        return -1
+
+    def sample(self, track: int) -> Optional[int]:
+        """
+        Returns a random track by the artist of ``track``,
+        or None if the track is unknown.
+        """
+        code = self.artist(track)
+        if code < 0:
+            return None
+        start, end = self.offsets[code], self.offsets[code + 1]
+        return int(self.tracks[start + random.randrange(end - start)])
+
+    def sample_many(self, tracks: List[int]) -> List[Optional[int]]:
+        tracks = np.asarray(tracks, dtype=np.int64)
+        known = (tracks >= 0) & (tracks < len(self.artist_codes))
+        codes = np.full(len(tracks), -1, dtype=np.int32)
+        codes[known] = self.artist_codes[tracks[known]]
+        known = codes >= 0
+
+        starts = self.offsets[codes[known]]
+        sizes = self.offsets[codes[known] + 1] - starts
+        picks = starts + (np.random.random(len(starts)) * sizes).astype(np.int64)
+        samples = np.full(len(tracks), -1, dtype=np.int64)
+        samples[known] = self.tracks[picks]
+        return [int(track) if track >= 0 else None for track in samples]
 
 
 class Catalog:
     """
     A helper class used to load track data upon server startup
     and store the data to redis.
+
+    ``listeners[name]`` (e.g. caches) are called whenever a sync of
+    ``name`` changes redis: with the list of rewritten keys, or with
+    None after keys were deleted, which can't be told apart by type.
     """
 
     def __init__(self, app):
+        # codec module needs Track, so it can't be imported at module level
+        from botify.codec import make_codec
+
         self.app = app
-        self.tracks = []
+        self.tracks = TrackColumns.read([])
+        self.catalog_path = None
+        self._artist_index = None
         self.top_tracks = []
+        self.listeners: Dict[str, List[Callable]] = defaultdict(list)
+        self.codec = make_codec(app.config.get("CATALOG_CODEC", "binary"))
 
     def load(self, catalog_path):
         self.app.logger.info(f"Loading tracks from {catalog_path}")
         with open(catalog_path) as catalog_file:
-            for j, line in enumerate(catalog_file):
-                data = json.loads(line)
-                self.tracks.append(
-                    Track(
-                        data["track"],
-                        data["artist"],
-                        data["title"],
-                        data.get("recommendations", []),
-                    )
-                )
-        self.app.logger.info(f"Loaded {j + 1} tracks")
+            self.tracks = TrackColumns.read(catalog_file)
+        self.catalog_path = catalog_path
+        self._artist_index = None
+        self.app.logger.info(
+            f"Loaded {len(self.tracks)} tracks by {len(self.tracks.artists)} artists"
+        )
         return self
 
+    def track_ids(self) -> np.ndarray:
+        return self.tracks.ids
+
+    def artist_index(self) -> ArtistIndex:
+        if self._artist_index is None:
+            self._artist_index = ArtistIndex(self.tracks)
+        return self._artist_index
+
     def upload_tracks(self, redis_tracks):
         self.app.logger.info(f"Uploading tracks to redis")
-        for track in self.tracks:
-            redis_tracks.set(track.track, self.to_bytes(track))
+        uploaded = self.sync(
+            redis_tracks,
+            "tracks",
+            self.catalog_path,
+            lambda: ((track.track, self.to_bytes(track)) for track in self.tracks),
+        )
+        self.app.logger.info(f"Uploaded {uploaded} tracks")
 
     def upload_artists(self, redis):
         self.app.logger.info(f"Uploading artists to redis")
-        uploaded = 0
-        sorted_tracks = sorted(self.tracks, key=lambda track: track.artist)
-        for artist, tracks in itertools.groupby(
-            sorted_tracks, key=lambda track: track.artist
-        ):
-            redis.set(artist, self.to_bytes([track.track for track in tracks]))
-            uploaded += 1
-
+        uploaded = self.sync(
+            redis,
+            "artists",
+            self.catalog_path,
+            lambda: (
+                (artist, self.to_bytes(tracks.tolist()))
+                for artist, tracks in self.tracks.by_artist(self.artist_index())
+            ),
+        )
         self.app.logger.info(f"Uploaded {uploaded} artists")
 
     def upload_recommendations(
-        self, redis, redis_config_key, key_object="user", key_recommendations="tracks"
+        self,
+        redis,
+        redis_config_key,
+        key_object="user",
+        key_recommendations="tracks",
+        with_successors=True,
+        path=None,
     ):
-        recommendations_file_path = self.app.config[redis_config_key]
+        """
+        Upload the list of recommendations for every object and,
+        unless ``with_successors`` is off, a hash of track -> next track
+        used by :class:`botify.recommenders.sequential.Sequential`.
+        Recommendations are read from ``path``, the file configured
+        under ``redis_config_key`` by default.
+        """
+        recommendations_file_path = path or self.app.config[redis_config_key]
         self.app.logger.info(
             f"Uploading recommendations from {recommendations_file_path} to redis"
         )
-        j = 0
-        with open(recommendations_file_path) as rf:
-            for line in rf:
-                recommendations = json.loads(line)
-                redis.set(
-                    recommendations[key_object],
-                    self.to_bytes(recommendations[key_recommendations]),
+
+        def items():
+            with open(recommendations_file_path) as rf:
+                yield from self.recommendation_items(
+                    map(json.loads, rf),
+                    key_object,
+                    key_recommendations,
+                    with_successors,
+                )
+
+        j = self.sync(
+            redis,
+            redis_config_key,
+            recommendations_file_path,
+            items,
+            key_object=key_object,
+            key_recommendations=key_recommendations,
+            with_successors=with_successors,
+        )
+        self.app.logger.info(
+            f"Uploaded {j} recommendation keys from {recommendations_file_path}"
+        )
+
+    def recommendation_items(
+        self, records, key_object, key_recommendations, with_successors
+    ):
+        for recommendations in records:
+            key = recommendations[key_object]
+            tracks = recommendations[key_recommendations]
+            yield key, self.to_bytes(tracks)
+            if with_successors and tracks:
+                yield successors_key(key), successors(tracks)
+
+    def sync(self, redis, name: str, source_path: str, items, **params) -> int:
+        """
+        Bring the keys derived from ``source_path`` up to date in redis.
+        Nothing is read if the file and ``params`` have the fingerprint
+        stored by the last sync, otherwise ``items()`` are written with
+        per-key digests, so only changed keys are rewritten and keys
+        that disappeared from the source are deleted.
+        """
+        current = fingerprint(source_path, codec=self.codec.name, **params)
+        if redis.get(fingerprint_key(name)) == current.encode():
+            self.app.logger.info(f"{source_path} is unchanged, skipping {name}")
+            return 0
+        uploaded = self.bulk_set(redis, items(), digests=digests_key(name), name=name)
+        redis.set(fingerprint_key(name), current)
+        return uploaded
+
+    def bulk_set(
+        self,
+        redis,
+        items: Iterable[Tuple[object, object]],
+        digests: str = None,
+        name: str = None,
+    ) -> int:
+        """
+        Write (key, value) pairs to redis with one pipelined round trip
+        per chunk of ``REDIS_UPLOAD_CHUNK_SIZE`` pairs: plain values go
+        in a single MSET, dict values replace the hash at their key.
+        Every chunk is applied atomically, in a transaction.
+        The items are consumed lazily, so only a single chunk is held
+        in memory at a time.
+
+        With a ``digests`` hash, values whose digest is unchanged are
+        skipped and keys missing from ``items`` are deleted. The
+        ``listeners`` of ``name`` are told about every change.
+        """
+        chunk_size = self.app.config.get("REDIS_UPLOAD_CHUNK_SIZE", 1000)
+        start = time.time()
+        uploaded, written = 0, 0
+        seen = set()
+        items = iter(items)
+        while True:
+            chunk = list(itertools.islice(items, chunk_size))
+            if not chunk:
+                break
+            uploaded += len(chunk)
+            if digests is not None:
+                chunk = self.changed(redis, digests, chunk, seen)
+                if not chunk:
+                    continue
+
+            # MULTI/EXEC, or readers could find a hash deleted but not rewritten
+            pipeline = redis.pipeline(transaction=True)
+            values = {key: value for key, value in chunk if not isinstance(value, dict)}
+            if values:
+                pipeline.mset(values)
+            for key, value in chunk:
+                if isinstance(value, dict):
+                    pipeline.delete(key)
+                    pipeline.hset(key, mapping=value)
+            if digests is not None:
+                pipeline.hset(
+                    digests, mapping={key: digest(value) for key, value in chunk}
                 )
-                j += 1
+            pipeline.execute()
+            written += len(chunk)
+            self.notify(name, [key for key, _ in chunk])
+
+        deleted = self.delete_missing(redis, digests, seen) if digests else 0
+        if deleted:
+            self.notify(name, None)
+        elapsed = time.time() - start
         self.app.logger.info(
-            f"Uploaded recommendations from {recommendations_file_path} for {j} {key_object}"
+            f"Wrote {written} of {uploaded} keys, deleted {deleted} "
+            f"in {elapsed:.2f}s ({uploaded / max(elapsed, 1e-9):.0f} keys/sec)"
         )
+        return uploaded
+
+    def notify(self, name: str, keys: Optional[List]):
+        for listener in self.listeners.get(name, []):
+            listener(keys)
+
+    @staticmethod
+    def changed(redis, digests: str, chunk, seen: set):
+        keys = [key for key, _ in chunk]
+        seen.update(str(key) for key in keys)
+        stored = redis.hmget(digests, keys)
+        return [
+            (key, value)
+            for (key, value), old in zip(chunk, stored)
+            if old != digest(value)
+        ]
+
+    def delete_missing(self, redis, digests: str, seen: set) -> int:
+        chunk_size = self.app.config.get("REDIS_UPLOAD_CHUNK_SIZE", 1000)
+        missing = [
+            key
+            for key, _ in redis.hscan_iter(digests, count=chunk_size)
+            if key.decode() not in seen
+        ]
+        for ix in range(0, len(missing), chunk_size):
+            keys = missing[ix : ix + chunk_size]
+            pipeline = redis.pipeline(transaction=False)
+            pipeline.delete(*keys)
+            pipeline.hdel(digests, *keys)
+            pipeline.execute()
+        return len(missing)
 
     def to_bytes(self, instance):
-        return pickle.dumps(instance)
+        return self.codec.to_bytes(instance)
 
     def from_bytes(self, bts):
-        return pickle.loads(bts)
+        if not isinstance(bts, (bytes, bytearray)):
+            # local stores (e.g. CsrStore) hand out already decoded values
+            return bts
+        with metrics.timer("botify_stage_seconds", stage="decode"):
+            return self.codec.from_bytes(bts)
@@ -1,5 +1,5 @@
-from typing import Dict, Optional
-from urllib.parse import urlunsplit
+from typing import Dict, List, Optional
+from urllib.parse import urlencode, urlunsplit
 
 import requests
 
@@ -8,6 +8,9 @@ from ..envs import RemoteRecommenderConfig
 
 SCHEME = "http"
 
+# number of the previous track's recommendations shown as hints
+SUGGESTIONS = 10
+
 
 class ConsoleRecommender(Recommender):
     """Provide recommendations manually, ftw"""
@@ -20,6 +23,9 @@ class ConsoleRecommender(Recommender):
         print(
             f"Got previous track {self.format(previous_track_info)} for user {observation['user']} with reward {reward}"
         )
+        suggestions = previous_track_info.get("recommendations", [])[:SUGGESTIONS]
+        for track_info in self.load_tracks_info(suggestions):
+            print(f"  {track_info['track']}: {self.format(track_info)}")
 
         recommendation = None
         while recommendation is None:
@@ -43,15 +49,28 @@ class ConsoleRecommender(Recommender):
             return recommendation
 
     def load_track_info(self, track) -> Optional[Dict]:
+        tracks = self.load_tracks_info([track])
+        return tracks[0] if tracks else None
+
+    def load_tracks_info(self, tracks: List[int]) -> List[Dict]:
+        """Load metadata of all the given tracks in a single call, skipping unknown ones"""
+        if not tracks:
+            return []
         url = urlunsplit(
-            (SCHEME, f"{self.config.host}:{self.config.port}", f"track/{track}", {}, "")
+            (
+                SCHEME,
+                f"{self.config.host}:{self.config.port}",
+                "tracks",
+                urlencode({"ids": ",".join(map(str, tracks))}),
+                "",
+            )
         )
         response = requests.get(url)
 
         if response.status_code != 200:
-            return None
+            return []
 
-        return response.json()
+        return response.json()["tracks"]
 
     def format(self, track_info):
         return f"'{track_info['title']}' by '{track_info['artist']}'"
@@ -1,6 +1,6 @@
 import json
 from io import StringIO, BytesIO
-from typing import Dict
+from typing import Dict, List
 
 from .recommender import Recommender
 from ..envs import RemoteRecommenderConfig
@@ -39,6 +39,27 @@ class RemoteRecommender(Recommender):
             response = self.post_urllib(url, data)
         return response.get("track")
 
+    def recommend_batch(
+        self, observations: List[Dict[str, int]], rewards: List[float]
+    ) -> List[int]:
+        """Recommend next tracks for several sessions in a single call"""
+        data = {
+            "items": [
+                {
+                    "user": int(observation["user"]),
+                    "track": int(observation["track"]),
+                    "time": reward,
+                }
+                for observation, reward in zip(observations, rewards)
+            ]
+        }
+        url = self.get_request_url("next_batch", {})
+        if use_pycurl:
+            response = self.post_curl(url, data)
+        else:
+            response = self.post_urllib(url, data)
+        return [item["track"] for item in response["items"]]
+
     def get_request_url(self, path, query_params):
         query = urlencode(query_params)
         return urlunsplit((SCHEME, f"{self.host}:{self.port}", path, query, ""))
@@ -47,6 +47,52 @@ def run_episode(day: int, episode: int, env: RecEnv, recommender: Recommender):
     return stats
 
 
+def run_batched_episodes(
+    day: int,
+    env: RecEnv,
+    episodes: int,
+    recommender: RemoteRecommender,
+    batch_size: int,
+    progress,
+):
+    """
+    Run up to ``batch_size`` sessions in lockstep, asking the remote
+    recommender for the next tracks of all of them in a single call.
+    A finished session is replaced by a new one until all the
+    episodes are played.
+    """
+    stats = []
+    sessions = []
+    started = 0
+
+    while started < episodes or sessions:
+        while started < episodes and len(sessions) < batch_size:
+            user = env.user_catalog.sample_user()
+            session = user.new_session(env.track_catalog)
+            sessions.append((user, session, EpisodeStats(day, started), 1.0))
+            started += 1
+
+        actions = recommender.recommend_batch(
+            [session.observe() for _, session, _, _ in sessions],
+            [reward for _, _, _, reward in sessions],
+        )
+
+        active = []
+        for (user, session, episode_stats, _), action in zip(sessions, actions):
+            reward = user.consume(action, session, env.track_catalog)
+            episode_stats.reward += reward
+            episode_stats.steps += 1
+            if session.finished:
+                recommender.recommend(session.observe(), reward, True)
+                stats.append(episode_stats)
+                progress.update(1)
+            else:
+                active.append((user, session, episode_stats, reward))
+        sessions = active
+
+    return stats
+
+
 def run_experiment(
     day: int,
     env: RecEnv,
@@ -54,6 +100,7 @@ def run_experiment(
     recommender: str,
     config: RecEnvConfig,
     position=None,
+    batch_size: int = 1,
 ):
     if recommender == DUMMY:
         recommender = DummyRecommender(env.action_space)
@@ -66,6 +113,10 @@ def run_experiment(
 
     stats = []
     with recommender, tqdm.tqdm(total=episodes, position=position) as progress:
+        if batch_size > 1 and isinstance(recommender, RemoteRecommender):
+            return run_batched_episodes(
+                day, env, episodes, recommender, batch_size, progress
+            )
         for episode_id in range(episodes):
             stats.append(run_episode(day, episode_id, env, recommender))
             progress.update(1)
@@ -83,7 +134,14 @@ def run_single(args):
         day = 1
         while True:
             stats.extend(
-                run_experiment(day, env, args.episodes, args.recommender, config)
+                run_experiment(
+                    day,
+                    env,
+                    args.episodes,
+                    args.recommender,
+                    config,
+                    batch_size=args.batch_size,
+                )
             )
 
             time_control = TimeControl()
@@ -103,7 +161,13 @@ def _run_multi(process, args):
     stats = []
     with RecEnv(config) as env:
         stats = run_experiment(
-            1, env, args.episodes, REMOTE, config, position=process + 1
+            1,
+            env,
+            args.episodes,
+            REMOTE,
+            config,
+            position=process + 1,
+            batch_size=args.batch_size,
         )
     return stats
 
@@ -130,6 +194,13 @@ def main():
         "--episodes", help="Number of episodes in experiment", type=int, default=100
     )
 
+    parser.add_argument(
+        "--batch-size",
+        help="Number of sessions the remote recommender is queried for in one call",
+        type=int,
+        default=1,
+    )
+
     subparsers = parser.add_subparsers(help="modes of execution")
 
     single_parser = subparsers.add_parser(